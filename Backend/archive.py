@@ -0,0 +1,78 @@
+"""
+Order archival: finished orders move from Order / OrderItem into
+ArchivedOrder / ArchivedOrderItem, keeping their ids, so the tables and
+indexes every checkout and order list touches only hold live orders.
+Their Payment rows move to ArchivedPayment.
+"""
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderItem, ArchivedPayment, Order, OrderItem, Payment
+
+ARCHIVABLE_STATUSES = ('delivered', 'cancelled')
+
+ORDER_FIELDS = [field.attname for field in Order._meta.concrete_fields]
+ITEM_FIELDS = [field.attname for field in OrderItem._meta.concrete_fields]
+PAYMENT_FIELDS = [field.attname for field in Payment._meta.concrete_fields]
+
+_archiving = ContextVar('archiving', default=False)
+
+
+def is_archiving():
+    """ True while archive_orders deletes the orders it has copied """
+    return _archiving.get()
+
+
+def archive_age():
+    return timedelta(days=getattr(settings, 'ORDER_ARCHIVE_DAYS', 365))
+
+
+def archive_orders(before=None, batch_size=500):
+    """
+    Move delivered and cancelled orders created before ``before`` (default:
+    ORDER_ARCHIVE_DAYS ago) to the archive, ``batch_size`` orders per
+    transaction. Returns the number of orders archived.
+    """
+    before = before or timezone.now() - archive_age()
+    archived = 0
+    while True:
+        with transaction.atomic():
+            # Orders another transaction holds are left for the next run
+            order_ids = list(
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(status__in=ARCHIVABLE_STATUSES, created_at__lt=before)
+                .exclude(reservations__status='active')
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not order_ids:
+                return archived
+
+            ArchivedOrder.objects.bulk_create([
+                ArchivedOrder(**row) for row in Order.objects.filter(pk__in=order_ids).values(*ORDER_FIELDS)
+            ])
+            ArchivedOrderItem.objects.bulk_create([
+                ArchivedOrderItem(**row)
+                for row in OrderItem.objects.filter(order_id__in=order_ids).values(*ITEM_FIELDS)
+            ])
+
+            ArchivedPayment.objects.bulk_create([
+                ArchivedPayment(**row)
+                for row in Payment.objects.filter(order_id__in=order_ids).values(*PAYMENT_FIELDS)
+            ])
+
+            # Cascades to the items, payments and released reservations. The
+            # rollup handler skips these: archived orders still count in sales.
+            token = _archiving.set(True)
+            try:
+                Order.objects.filter(pk__in=order_ids).delete()
+            finally:
+                _archiving.reset(token)
+            archived += len(order_ids)
+
+        if len(order_ids) < batch_size:
+            return archived
@@ -0,0 +1,140 @@
+"""
+Async counterparts of the hot read endpoints, for ASGI servers.
+
+They use Django's async ORM so one worker can hold many slow client
+connections without a thread per request, and return the same JSON as
+the DRF views they mirror.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import JsonResponse
+from rest_framework import exceptions
+from rest_framework.request import Request
+
+from .authentication import CachedJWTAuthentication
+from .facets import facet_counts, filter_products
+from .models import *
+from .pagination import CatalogCursorPagination, SearchPagination
+from .routers import read_from_replicas
+from .search import get_search_backend
+from .serializers import *
+from .throttling import TokenBucketThrottle, throttle_wait
+
+
+def _auth_error(exc, authenticator):
+    # Same body and headers DRF's exception handler produces
+    data = exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail}
+    response = JsonResponse(data, status=exc.status_code)
+    response['WWW-Authenticate'] = authenticator.authenticate_header(request=None)
+    return response
+
+
+async def _authenticate(request):
+    """
+    ``(user, None)``, with AnonymousUser when there is no token, or
+    ``(None, error response)`` for a token DRF would refuse.
+    """
+    authenticator = CachedJWTAuthentication()
+    try:
+        result = await sync_to_async(authenticator.authenticate)(request)
+    except exceptions.APIException as exc:
+        return None, _auth_error(exc, authenticator)
+    return (result[0] if result else AnonymousUser()), None
+
+
+async def _throttle(request, scope):
+    """ The 429 TokenBucketThrottle would give the request, or None """
+    user, error = await _authenticate(request)
+    if error is not None:
+        return error
+    wait = await sync_to_async(throttle_wait)(scope, user, TokenBucketThrottle().get_ident(request))
+    if not wait:
+        return None
+    exc = exceptions.Throttled(wait)
+    response = JsonResponse({'detail': exc.detail}, status=exc.status_code)
+    response['Retry-After'] = str(exc.wait)
+    return response
+
+
+async def product_list(request):
+    with read_from_replicas():
+        return await _product_list(request)
+
+
+async def _product_list(request):
+    queryset = Product.objects.filter(is_active=True).select_related('category')
+    search = request.GET.get('search', None)
+    try:
+        queryset = filter_products(queryset, request.GET)
+        serializer = ProductSerializer(context={'request': request})
+    except exceptions.ValidationError as exc:
+        return JsonResponse(exc.detail, status=exc.status_code)
+
+    if search:
+        # Same limit as the DRF route, sharing its buckets
+        throttled = await _throttle(request, 'search')
+        if throttled is not None:
+            return throttled
+        # The fallback backend may build its index from the database
+        queryset = await sync_to_async(get_search_backend().search)(queryset, search)
+        paginator = SearchPagination()
+    else:
+        paginator = CatalogCursorPagination()
+
+    drf_request = Request(request)
+    rows = queryset.values(*dict.fromkeys([*serializer.row_columns, 'created_at']))
+    page = await sync_to_async(paginator.paginate_queryset)(rows, drf_request)
+    if page is not None:
+        data = [serializer.to_representation(row) for row in page]
+        data = paginator.get_paginated_response(data).data
+        if request.GET.get('facets') in ('1', 'true'):
+            data['facets'] = await sync_to_async(facet_counts)(queryset)
+        return JsonResponse(data)
+
+    data = [serializer.to_representation(row) async for row in queryset.values(*serializer.row_columns)]
+    if request.GET.get('facets') in ('1', 'true'):
+        return JsonResponse({'results': data, 'facets': await sync_to_async(facet_counts)(queryset)})
+    return JsonResponse(data, safe=False)
+
+
+async def product_detail(request, pk):
+    try:
+        serializer = ProductSerializer(context={'request': request})
+    except exceptions.ValidationError as exc:
+        return JsonResponse(exc.detail, status=exc.status_code)
+    queryset = Product.objects.select_related('category')
+    if serializer.selected_fields is not None:
+        queryset = queryset.only(*serializer.row_columns)
+    try:
+        with read_from_replicas():
+            product = await queryset.aget(pk=pk, is_active=True)
+    except (Product.DoesNotExist, ValueError):
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    return JsonResponse(serializer.to_representation(product))
+
+
+async def category_list(request):
+    try:
+        serializer = CategorySerializer(context={'query_params': request.GET})
+    except exceptions.ValidationError as exc:
+        return JsonResponse(exc.detail, status=exc.status_code)
+    with read_from_replicas():
+        data = [serializer.to_representation(row) async for row in Category.objects.values(*serializer.row_columns)]
+    return JsonResponse(data, safe=False)
+
+
+async def cart_detail(request):
+    user, error = await _authenticate(request)
+    if error is not None:
+        return error
+    if not user.is_authenticated:
+        return _auth_error(exceptions.NotAuthenticated(), CachedJWTAuthentication())
+
+    try:
+        serializer = CartSerializer(context={'query_params': request.GET})
+    except exceptions.ValidationError as exc:
+        return JsonResponse(exc.detail, status=exc.status_code)
+    cart, created = await Cart.objects.aget_or_create(user=user)
+    # Fill Cart.snapshot_items with the async ORM so serializing needs no query
+    cart.snapshot_items = [item async for item in cart.items.with_totals()]
+    return JsonResponse(serializer.to_representation(cart))
@@ -0,0 +1,112 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+VERSION_CLAIM = 'ver'
+CART_CLAIM = 'cart_id'
+
+
+def credentials_version(user):
+    """
+    Short fingerprint of everything that must invalidate a token: the
+    password hash, staff flag and active flag.
+    """
+    value = f'{user.get_session_auth_hash()}:{user.is_staff}:{user.is_active}'
+    return salted_hmac('Backend.authentication', value).hexdigest()[:16]
+
+
+def add_claims(token, user, cart_id):
+    token[VERSION_CLAIM] = credentials_version(user)
+    token[CART_CLAIM] = cart_id
+    return token
+
+
+class UserCache:
+    """ Small per-process LRU of authenticated users, keyed by id and credentials version """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # user_id -> (expires_at, version, user)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'AUTH_USER_CACHE_SECONDS', 60)
+
+    def get(self, user_id, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, cached_version, user = entry
+            if expires_at < time.monotonic() or cached_version != version:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+        # Views may touch the instance; never hand out the shared copy
+        return copy.copy(user)
+
+    def set(self, user, version):
+        with self._lock:
+            self._entries[user.pk] = (time.monotonic() + self.ttl, version, copy.copy(user))
+            self._entries.move_to_end(user.pk)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that does not touch the database for recently seen users.
+
+    Login tokens carry a credentials version claim; a user cached within the
+    last ``AUTH_USER_CACHE_SECONDS`` under the same version is returned
+    without a query. On a miss the user is loaded once and the token is
+    rejected if the password, staff or active flag changed since it was
+    issued. Tokens without the claim are handled exactly like simplejwt.
+
+    Saving a user drops its entry in this process only; other worker
+    processes keep serving it until their entry expires, so a password or
+    staff change reaches them within ``AUTH_USER_CACHE_SECONDS``.
+    """
+
+    def get_user(self, validated_token):
+        version = validated_token.get(VERSION_CLAIM)
+        if version is None:
+            return super().get_user(validated_token)
+
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = user_cache.get(user_id, version)
+        if user is not None:
+            return user
+
+        user = super().get_user(validated_token)
+        if credentials_version(user) != version:
+            raise AuthenticationFailed('Token is no longer valid for this user', code='token_revoked')
+        user_cache.set(user, version)
+        return user
+
+
+def request_cart_id(request):
+    """ Cart id signed into the access token at login, if any """
+    token = getattr(request, 'auth', None)
+    if token is None or not hasattr(token, 'get'):
+        return None
+    return token.get(CART_CLAIM)
@@ -0,0 +1,402 @@
+"""
+Endpoint benchmark: seeds a catalog, then drives every route in
+``Backend/urls.py`` through the test client, recording latency and SQL
+query counts per endpoint against a declared query budget.
+
+Run it through the test suite::
+
+    BENCH_PRODUCTS=5000 BENCH_ORDERS=2000 python manage.py test Backend.tests.EndpointBudgetTests
+
+Budgets are per request and must not depend on the seeded volume; a
+serializer that starts issuing a query per row blows through them.
+
+``serializer_throughput`` separately measures rows per second through the
+generic DRF representation and the compiled one (Backend.representations).
+"""
+import os
+import time
+from datetime import timedelta
+from itertools import count
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.serializers import ModelSerializer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .archive import archive_orders
+from .counters import rebuild_product_counts
+from .models import *
+from .rollups import rebuild_rollups
+from .serializers import CartSerializer, CategorySerializer, ProductSerializer
+
+DEFAULT_VOLUMES = {
+    'categories': 8,
+    'products': 400,
+    'users': 20,
+    'cart_items': 5,
+    'orders': 200,
+    'order_items': 3,
+}
+
+SHIPPING = {
+    'shipping_address': '1 Bench St',
+    'shipping_city': 'Benchville',
+    'shipping_zip': '00000',
+    'shipping_country': 'US',
+}
+
+# Smallest valid GIF, for product create
+PIXEL = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00'
+         b'\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
+
+
+def volumes_from_env():
+    return {name: int(os.environ.get(f'BENCH_{name.upper()}', default))
+            for name, default in DEFAULT_VOLUMES.items()}
+
+
+def seed(volumes):
+    """ Bulk-load the catalog, users, carts and orders; returns the fixtures the endpoints need """
+    categories = Category.objects.bulk_create([
+        Category(name=f'Category {i}', description=f'Things of kind {i}')
+        for i in range(volumes['categories'])
+    ])
+    products = Product.objects.bulk_create([
+        Product(name=f'Product {i}', description=f'Sturdy widget number {i}',
+                price=5 + i % 95, category=categories[i % len(categories)],
+                image='products/bench.jpg', stock=5 + i % 40)
+        for i in range(volumes['products'])
+    ])
+    password = make_password('bench-password')
+    users = User.objects.bulk_create([
+        User(username=f'bench{i}', email=f'bench{i}@example.com', password=password)
+        for i in range(volumes['users'])
+    ])
+    admin = User.objects.create(username='bench-admin', email='admin@example.com',
+                                password=password, is_staff=True)
+
+    carts = Cart.objects.bulk_create([Cart(user=user) for user in users])
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product=products[(c * 7 + i) % len(products)], quantity=1)
+        for c, cart in enumerate(carts)
+        for i in range(volumes['cart_items'])
+    ])
+
+    orders = Order.objects.bulk_create([
+        Order(user=users[i % len(users)], total_amount=100, tax_amount=10,
+              payment_status='completed' if i % 3 else 'pending', **SHIPPING)
+        for i in range(volumes['orders'])
+    ])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=products[(o + i) % len(products)], quantity=1, price=30)
+        for o, order in enumerate(orders)
+        for i in range(volumes['order_items'])
+    ])
+
+    # bulk_create skips the signals that maintain these
+    rebuild_product_counts()
+    rebuild_rollups()
+
+    return {
+        'user': users[0],
+        'admin': admin,
+        'category': categories[0],
+        'product': products[0],
+        'order': orders[0],
+    }
+
+
+class Endpoint:
+    def __init__(self, name, method, path, budget, user='user', data=None,
+                 setup=None, status=200, iterations=None, format='json', headers=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.budget = budget
+        self.user = user
+        self.data = data
+        self.setup = setup
+        self.status = status
+        self.iterations = iterations
+        self.format = format
+        self.headers = headers
+
+
+def _fill_cart(ctx):
+    cart = Cart.objects.get(user=ctx['user'])
+    CartItem.objects.filter(cart=cart).delete()
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product=product, quantity=1)
+        for product in Product.objects.filter(stock__gte=5)[:5]
+    ])
+    ctx['cart_item'] = CartItem.objects.filter(cart=cart).first()
+
+
+def _pending_order(ctx):
+    ctx['pending_order'] = Order.objects.create(user=ctx['user'], total_amount=30, **SHIPPING)
+    OrderItem.objects.create(order=ctx['pending_order'], product=ctx['product'], quantity=1, price=30)
+
+
+def _archived_order(ctx):
+    if 'archived_order' not in ctx:
+        order = Order.objects.create(user=ctx['user'], total_amount=30, status='delivered', **SHIPPING)
+        OrderItem.objects.create(order=order, product=ctx['product'], quantity=1, price=30)
+        archive_orders(before=timezone.now() + timedelta(days=1))
+        ctx['archived_order'] = ArchivedOrder.objects.get(pk=order.pk)
+
+
+def _keyed_checkout(ctx):
+    """ Place one order under an Idempotency-Key, so the endpoint measures its retries """
+    if 'checkout_key' not in ctx:
+        _fill_cart(ctx)
+        ctx['checkout_key'] = {'HTTP_IDEMPOTENCY_KEY': f'bench-checkout-{next(_skus)}'}
+        client = APIClient()
+        client.force_authenticate(ctx['user'])
+        client.post('/api/orders/', SHIPPING, format='json', **ctx['checkout_key'])
+
+
+def _spare_category(ctx):
+    ctx['spare_category'] = Category.objects.create(name='Spare', description='')
+
+
+def _spare_product(ctx):
+    ctx['spare_product'] = Product.objects.create(
+        name='Spare', description='', price=1, category=ctx['category'], image='products/bench.jpg'
+    )
+
+
+def _refresh_token(ctx):
+    ctx['refresh'] = str(RefreshToken.for_user(ctx['user']))
+
+
+def _bearer(ctx):
+    # The async views authenticate from the header, not force_authenticate
+    return {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(ctx['user']).access_token}"}
+
+
+def _catalog(ctx):
+    """ A small import file: one new SKU, one update, one invalid row """
+    category = ctx['category'].name
+    return (f"sku,name,price,category,stock\n"
+            f"BENCH-{next(_skus)},Imported,4.50,{category},3\n"
+            f"BENCH-UPDATED,Reimported,5.00,{category},7\n"
+            f"BENCH-BAD,Broken,not-a-price,{category},1\n").encode()
+
+
+_usernames = count()
+_skus = count()
+
+
+def endpoints():
+    """ Every route in Backend/urls.py with its per-request query budget """
+    return [
+        Endpoint('api root', 'get', lambda c: '/api/', 0, user=None),
+        Endpoint('register', 'post', lambda c: '/api/auth/register/', 2, user=None, status=201, iterations=1,
+                 data=lambda c: {'username': f'new{next(_usernames)}', 'email': 'new@example.com',
+                                 'password': 'Sufficiently-long-9', 'password2': 'Sufficiently-long-9'}),
+        Endpoint('login', 'post', lambda c: '/api/auth/login/', 2, user=None, iterations=1,
+                 data=lambda c: {'username': c['user'].username, 'password': 'bench-password'}),
+        Endpoint('refresh', 'post', lambda c: '/api/auth/refresh/', 0, user=None, setup=_refresh_token,
+                 data=lambda c: {'refresh': c['refresh']}),
+        Endpoint('profile', 'get', lambda c: '/api/auth/profile/', 4),
+        Endpoint('profile update', 'patch', lambda c: '/api/auth/profile/', 3, data={'city': 'Bench City'}),
+        Endpoint('metrics', 'get', lambda c: '/api/metrics', 0, user='admin'),
+
+        Endpoint('category list', 'get', lambda c: '/api/categories/', 2, user=None),
+        Endpoint('category detail', 'get', lambda c: f"/api/categories/{c['category'].id}/", 1, user=None),
+        Endpoint('category create', 'post', lambda c: '/api/categories/', 1, user='admin', status=201,
+                 data={'name': 'New', 'description': 'Fresh'}),
+        Endpoint('category update', 'patch', lambda c: f"/api/categories/{c['category'].id}/", 2,
+                 user='admin', data={'description': 'Updated'}),
+        Endpoint('category delete', 'delete', lambda c: f"/api/categories/{c['spare_category'].id}/", 3,
+                 user='admin', status=204, setup=_spare_category),
+
+        Endpoint('product list', 'get', lambda c: '/api/products/', 2, user=None),
+        Endpoint('product list page', 'get', lambda c: '/api/products/?page_size=24', 2, user=None),
+        Endpoint('product list category', 'get', lambda c: f"/api/products/?category={c['category'].id}", 2,
+                 user=None),
+        # Relevance-ordered pages count their total
+        Endpoint('product search', 'get', lambda c: '/api/products/?search=sturdy widget', 4, user=None),
+        Endpoint('product facets', 'get', lambda c: '/api/products/?facets=1&in_stock=1&min_price=5&page_size=24',
+                 3, user=None),
+        Endpoint('product detail', 'get', lambda c: f"/api/products/{c['product'].id}/", 1, user=None),
+        Endpoint('product create', 'post', lambda c: '/api/products/', 3, user='admin', status=201,
+                 format='multipart',
+                 data=lambda c: {'name': 'Created', 'description': 'New', 'price': '9.99',
+                                 'category': c['category'].id, 'stock': 3,
+                                 'image': SimpleUploadedFile('pixel.gif', PIXEL, 'image/gif')}),
+        Endpoint('product update', 'patch', lambda c: f"/api/products/{c['product'].id}/", 4, user='admin',
+                 data={'price': '12.50'}),
+        Endpoint('product delete', 'delete', lambda c: f"/api/products/{c['spare_product'].id}/", 8,
+                 user='admin', status=204, setup=_spare_product),
+        Endpoint('low stock', 'get', lambda c: '/api/products/low_stock/', 1, user='admin'),
+        Endpoint('stock alerts', 'get', lambda c: '/api/products/stock_alerts/', 1, user='admin'),
+        Endpoint('product import', 'post', lambda c: '/api/products/import/', 8, user='admin',
+                 format='multipart', data=lambda c: {'file': SimpleUploadedFile('catalog.csv', _catalog(c))}),
+
+        Endpoint('cart', 'get', lambda c: '/api/cart/', 2),
+        Endpoint('cart add', 'post', lambda c: '/api/cart/add_item/', 8, setup=_fill_cart,
+                 data=lambda c: {'product_id': c['product'].id, 'quantity': 1}),
+        Endpoint('cart update', 'patch', lambda c: '/api/cart/update_item/', 5, setup=_fill_cart,
+                 data=lambda c: {'item_id': c['cart_item'].id, 'quantity': 2}),
+        Endpoint('cart remove', 'delete', lambda c: f"/api/cart/remove_item/?item_id={c['cart_item'].id}", 4,
+                 setup=_fill_cart),
+        Endpoint('cart batch', 'post', lambda c: '/api/cart/batch/', 8, setup=_fill_cart,
+                 data=lambda c: {'operations': [
+                     {'op': 'add', 'product_id': c['product'].id, 'quantity': 1},
+                     {'op': 'set', 'item_id': c['cart_item'].id, 'quantity': 2},
+                 ]}),
+        Endpoint('cart clear', 'post', lambda c: '/api/cart/clear/', 3, setup=_fill_cart),
+
+        Endpoint('order list', 'get', lambda c: '/api/orders/', 1),
+        Endpoint('order list staff', 'get', lambda c: '/api/orders/', 1, user='admin'),
+        Endpoint('order detail', 'get', lambda c: f"/api/orders/{c['order'].id}/", 2, user='admin'),
+        Endpoint('archived order list', 'get', lambda c: '/api/orders/?archived=1', 1, setup=_archived_order),
+        Endpoint('archived order detail', 'get', lambda c: f"/api/orders/{c['archived_order'].id}/", 3,
+                 setup=_archived_order),
+        Endpoint('checkout', 'post', lambda c: '/api/orders/', 16, setup=_fill_cart, status=201,
+                 data=SHIPPING),
+        Endpoint('checkout replay', 'post', lambda c: '/api/orders/', 1, setup=_keyed_checkout, status=201,
+                 data=SHIPPING, headers=lambda c: c['checkout_key']),
+        Endpoint('order status', 'patch', lambda c: f"/api/orders/{c['order'].id}/update_status/", 6,
+                 user='admin', data={'status': 'processing'}),
+        Endpoint('analytics', 'get', lambda c: '/api/orders/analytics/', 2, user='admin'),
+        Endpoint('order export', 'get', lambda c: '/api/orders/export/', 3, user='admin'),
+        Endpoint('order export jsonl', 'get', lambda c: '/api/orders/export/?output=jsonl', 3, user='admin'),
+        Endpoint('confirm payment', 'post',
+                 lambda c: f"/api/orders/{c['pending_order'].id}/confirm_payment/", 13,
+                 setup=_pending_order),
+
+        Endpoint('async product list', 'get', lambda c: '/api/async/products/', 1, user=None),
+        Endpoint('async product page', 'get', lambda c: '/api/async/products/?page_size=24', 1, user=None),
+        Endpoint('async product facets', 'get',
+                 lambda c: '/api/async/products/?facets=1&in_stock=1&min_price=5&page_size=24', 2, user=None),
+        Endpoint('async product search', 'get', lambda c: '/api/async/products/?search=sturdy widget', 2,
+                 user=None),
+        Endpoint('async product detail', 'get', lambda c: f"/api/async/products/{c['product'].id}/", 1,
+                 user=None),
+        Endpoint('async category list', 'get', lambda c: '/api/async/categories/', 1, user=None),
+        Endpoint('async cart', 'get', lambda c: '/api/async/cart/', 3, user=None, headers=_bearer),
+    ]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run(ctx, cases=None, iterations=20):
+    """ Exercise each endpoint ``iterations`` times; returns one result dict per endpoint """
+    results = []
+    for case in cases or endpoints():
+        client = APIClient()
+        if case.user:
+            client.force_authenticate(ctx[case.user])
+        request = getattr(client, case.method)
+
+        latencies, queries, failures = [], [], []
+        for _ in range(case.iterations or iterations):
+            if case.setup:
+                case.setup(ctx)
+            data = case.data(ctx) if callable(case.data) else case.data
+            kwargs = {'format': case.format} if data is not None else {}
+            if case.headers:
+                kwargs.update(case.headers(ctx))
+            path = case.path(ctx)
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = request(path, data, **kwargs)
+                # Streamed bodies run their queries as they are read
+                body = b''.join(response.streaming_content) if response.streaming else response.content
+                latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+            if response.status_code != case.status:
+                failures.append(f'{response.status_code}: {body[:200]!r}')
+
+        results.append({
+            'name': case.name,
+            'method': case.method.upper(),
+            'budget': case.budget,
+            'queries': max(queries),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'failures': failures,
+        })
+    return results
+
+
+def format_report(results):
+    lines = [f"{'endpoint':<24}{'method':<8}{'queries':>8}{'budget':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+    for row in results:
+        flag = '  OVER BUDGET' if row['queries'] > row['budget'] else ''
+        lines.append(
+            f"{row['name']:<24}{row['method']:<8}{row['queries']:>8}{row['budget']:>8}"
+            f"{row['p50']:>10.2f}{row['p95']:>10.2f}{row['p99']:>10.2f}{flag}"
+        )
+    return '\n'.join(lines)
+
+
+def serializer_throughput(repeat=3):
+    """
+    Rows per second serializing the seeded products, categories and carts
+    (cart lines for carts), through the generic DRF path (``before``) and
+    the compiled one (``after``), queries included; best of ``repeat``.
+    """
+    context = {'request': RequestFactory().get('/api/products/')}
+    carts = list(Cart.objects.all())
+    cases = [
+        ('product list', Product.objects.filter(is_active=True).select_related('category'), ProductSerializer),
+        ('category list', Category.objects.all(), CategorySerializer),
+    ]
+
+    results = []
+    for name, queryset, serializer_class in cases:
+        generic = serializer_class(context=context)
+        results.append(_throughput(
+            name, queryset.count(),
+            lambda: [ModelSerializer.to_representation(generic, obj) for obj in queryset.all()],
+            lambda: serializer_class(queryset.all(), many=True, context=context).data,
+            repeat,
+        ))
+
+    def generic_carts():
+        for cart in carts:
+            cart.__dict__.pop('snapshot_items', None)
+            ModelSerializer.to_representation(CartSerializer(context=context), cart)
+
+    results.append(_throughput(
+        'cart', CartItem.objects.count(), generic_carts,
+        lambda: [CartSerializer(cart, context=context).data for cart in carts],
+        repeat,
+    ))
+    return results
+
+
+def _throughput(name, rows, before, after, repeat):
+    timings = {}
+    for label, func in (('before', before), ('after', after)):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        timings[label] = rows / best if best else float('inf')
+    return {'name': name, 'rows': rows, **timings}
+
+
+def format_throughput(results):
+    lines = [f"{'serializer':<24}{'rows':>8}{'before rows/s':>16}{'after rows/s':>16}{'speedup':>10}"]
+    for row in results:
+        lines.append(
+            f"{row['name']:<24}{row['rows']:>8}{row['before']:>16,.0f}{row['after']:>16,.0f}"
+            f"{row['after'] / row['before']:>9.1f}x"
+        )
+    return '\n'.join(lines)
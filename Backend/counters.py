@@ -0,0 +1,31 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Category, Product
+
+
+def adjust_product_count(category_id, delta):
+    if category_id and delta:
+        Category.objects.filter(pk=category_id).update(
+            active_product_count=F('active_product_count') + delta,
+            updated_at=timezone.now(),
+        )
+
+
+def rebuild_product_counts(category_ids=None):
+    """ Recompute ``Category.active_product_count`` from the product table in one UPDATE """
+    active = (
+        Product.objects.filter(category=OuterRef('pk'), is_active=True)
+        .order_by()
+        .values('category')
+        .annotate(n=Count('pk'))
+        .values('n')
+    )
+    categories = Category.objects.all()
+    if category_ids is not None:
+        categories = categories.filter(pk__in=category_ids)
+    return categories.update(
+        active_product_count=Coalesce(Subquery(active, output_field=IntegerField()), Value(0)),
+        updated_at=timezone.now(),
+    )
@@ -0,0 +1,102 @@
+"""
+Catalog filters and facet counts for the shop page.
+
+``filter_products`` applies the query-string filters. ``facet_counts``
+then counts the filtered products per category, price range and stock
+state with one GROUP BY over those three keys; every facet is a sum over
+the (few) groups it returns, instead of one COUNT query per facet value.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import BooleanField, Case, Count, ExpressionWrapper, IntegerField, Q, Value, When
+from rest_framework.exceptions import ValidationError
+
+# (min, max) price bands, max exclusive; None leaves a side open
+DEFAULT_PRICE_RANGES = ((0, 25), (25, 50), (50, 100), (100, 250), (250, None))
+
+
+def price_ranges():
+    return getattr(settings, 'CATALOG_PRICE_RANGES', DEFAULT_PRICE_RANGES)
+
+
+def _price(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        raise ValidationError({name: ['A valid number is required.']})
+    if not price.is_finite():
+        raise ValidationError({name: ['A valid number is required.']})
+    return price
+
+
+def filter_products(queryset, params):
+    """ Apply the ``category``, ``min_price``, ``max_price`` and ``in_stock`` query parameters """
+    category = params.get('category')
+    min_price = _price(params, 'min_price')
+    max_price = _price(params, 'max_price')
+
+    if category:
+        queryset = queryset.filter(category__id=category)
+    if min_price is not None:
+        queryset = queryset.filter(price__gte=min_price)
+    if max_price is not None:
+        queryset = queryset.filter(price__lte=max_price)
+    if params.get('in_stock') in ('1', 'true'):
+        queryset = queryset.filter(stock__gt=0)
+    return queryset
+
+
+def facet_counts(queryset):
+    """
+    ``{'count', 'in_stock', 'price_ranges', 'categories'}`` for the products
+    in ``queryset``, from a single grouped aggregate.
+    """
+    ranges = price_ranges()
+    band = Case(
+        *[When(_band_filter(low, high), then=Value(index)) for index, (low, high) in enumerate(ranges)],
+        default=None, output_field=IntegerField(),
+    )
+    groups = (
+        queryset.order_by()
+        .annotate(price_band=band,
+                  has_stock=ExpressionWrapper(Q(stock__gt=0), output_field=BooleanField()))
+        .values('category_id', 'category__name', 'price_band', 'has_stock')
+        .annotate(count=Count('pk'))
+    )
+
+    total = in_stock = 0
+    bands = [0] * len(ranges)
+    categories = {}
+    for group in groups:
+        count = group['count']
+        total += count
+        if group['has_stock']:
+            in_stock += count
+        if group['price_band'] is not None:
+            bands[group['price_band']] += count
+        category = categories.setdefault(
+            group['category_id'], {'id': group['category_id'], 'name': group['category__name'], 'count': 0}
+        )
+        category['count'] += count
+
+    return {
+        'count': total,
+        'in_stock': in_stock,
+        'price_ranges': [
+            {'min': low, 'max': high, 'count': count} for (low, high), count in zip(ranges, bands)
+        ],
+        'categories': sorted(categories.values(), key=lambda category: category['name']),
+    }
+
+
+def _band_filter(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
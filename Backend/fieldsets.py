@@ -0,0 +1,36 @@
+"""
+Sparse fieldsets: ``?fields=id,name,price`` keeps only those top-level
+fields of a response, ``?omit=description`` drops some. Serializers with
+SparseFieldsMixin leave the other fields out, and the views narrow their
+queries to match, so columns nobody asked for aren't read either.
+"""
+from rest_framework.exceptions import ValidationError
+
+
+def _names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def sparse_fields(params, available):
+    """
+    The names from ``available`` (in its order) that ``params`` selects,
+    or None when it has neither ``fields`` nor ``omit``.
+    """
+    fields, omit = params.get('fields'), params.get('omit')
+    if not fields and not omit:
+        return None
+    wanted = _names(fields) if fields else list(available)
+    omitted = _names(omit) if omit else []
+    unknown = [name for name in wanted + omitted if name not in available]
+    if unknown:
+        raise ValidationError({'fields': [f'Unknown field "{name}".' for name in unknown]})
+    return [name for name in available if name in wanted and name not in omitted]
+
+
+def context_params(context):
+    """ The query parameters a serializer's fieldset comes from """
+    if 'query_params' in context:
+        return context['query_params']
+    request = context.get('request')
+    # A DRF request, or the plain Django one the async views pass
+    return getattr(request, 'query_params', None) or getattr(request, 'GET', {})
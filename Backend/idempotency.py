@@ -0,0 +1,113 @@
+"""
+Idempotency-Key support for POSTs a client may retry.
+
+The first request with a key runs the view and stores its response in the
+same transaction as the view's writes. A retry with that key gets the
+stored response back without running the view again, so a checkout or
+payment replayed by a flaky network (or by the frontend's token refresh)
+never touches the cart or stock twice. Keys expire after
+IDEMPOTENCY_KEY_HOURS and are swept by ``manage.py purge_idempotency_keys``.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+def key_lifetime():
+    return timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_HOURS', 24))
+
+
+def request_fingerprint(request):
+    """ Hash of what the request asks for, so a key can't be reused for a different one """
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f'{request.method}\n{request.path}\n{body}'.encode()).hexdigest()
+
+
+def idempotent(view):
+    """
+    Make a viewset action honour the Idempotency-Key header. Requests
+    without the header run as before. Place it above @transaction.atomic
+    so the view's writes and the stored response commit together.
+    """
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request)
+        stored = _stored(request.user, key)
+        if stored is not None:
+            return _replay(stored, fingerprint)
+
+        now = timezone.now()
+        with transaction.atomic():
+            try:
+                # Its own savepoint, so losing the race leaves the outer block usable
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=request.user, key=key, fingerprint=fingerprint,
+                        status_code=0, expires_at=now + key_lifetime(),
+                    )
+            except IntegrityError:
+                record = None
+            if record is not None:
+                response = view(self, request, *args, **kwargs)
+                if response.status_code >= 500:
+                    # Not an answer worth repeating; free the key for a retry
+                    transaction.set_rollback(True)
+                    return response
+                record.status_code = response.status_code
+                record.response = response.data
+                record.save(update_fields=['status_code', 'response'])
+                return response
+
+        # A concurrent request with the same key committed first; the insert
+        # above waited for it, so its response is there now
+        stored = _stored(request.user, key)
+        if stored is None:
+            # ...unless it had already expired and went just now
+            return Response({'error': f'A request with this {HEADER} was in progress; retry it'},
+                            status=status.HTTP_409_CONFLICT)
+        return _replay(stored, fingerprint)
+
+    return wrapper
+
+
+def _stored(user, key):
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if record is not None and record.expires_at <= timezone.now():
+        # Expired but not swept yet: the key is free again
+        record.delete()
+        return None
+    return record
+
+
+def _replay(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return Response({'error': f'{HEADER} was already used for a different request'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    return Response(record.response, status=record.status_code, headers={REPLAYED_HEADER: 'true'})
+
+
+def purge_expired_keys(now=None):
+    """ Delete keys past their expiry; returns how many went """
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
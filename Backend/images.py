@@ -0,0 +1,84 @@
+"""
+Resized WebP derivatives of product images for grid tiles and srcset.
+
+Variants are generated by the job worker (Backend.jobs) after the saving
+transaction commits, and named after a hash of the source file so their
+URLs never change and can be cached forever.
+"""
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .jobs import enqueue, task
+from .models import Product
+
+VARIANT_DIR = 'products/variants'
+DEFAULT_WIDTHS = (160, 320, 640, 1280)
+
+
+def variant_widths():
+    return getattr(settings, 'IMAGE_VARIANT_WIDTHS', DEFAULT_WIDTHS)
+
+
+def variant_quality():
+    return getattr(settings, 'IMAGE_VARIANT_QUALITY', 80)
+
+
+def is_current(product):
+    """ Whether the recorded variants were made from the product's current image """
+    return bool(product.image) and product.image_variants.get('source') == product.image.name
+
+
+def render_variants(data, widths):
+    """ ``{width: WebP bytes}`` for the encoded image ``data``, never upscaling """
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.mode else 'RGB')
+
+    rendered = {}
+    for width in sorted({min(width, image.width) for width in widths}):
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, 'WEBP', quality=variant_quality(), method=4)
+        rendered[width] = buffer.getvalue()
+    return rendered
+
+
+def generate_variants(product):
+    """ Write the product's variants to storage and record them on its row """
+    with product.image.open('rb') as source:
+        data = source.read()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+
+    names = {}
+    for width, encoded in render_variants(data, variant_widths()).items():
+        name = f'{VARIANT_DIR}/{digest}-{width}w.webp'
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(encoded))
+        names[str(width)] = name
+
+    # Only if the image wasn't replaced meanwhile; updated_at versions the ETag
+    Product.objects.filter(pk=product.pk, image=product.image.name).update(
+        image_variants={'source': product.image.name, 'widths': names},
+        updated_at=timezone.now(),
+    )
+    return names
+
+
+def schedule_variants(product_id):
+    """ Generate variants off the request path, once the current transaction commits """
+    enqueue(refresh_variants, product_id=product_id)
+
+
+@task
+def refresh_variants(product_id):
+    product = Product.objects.filter(pk=product_id).first()
+    # Deleted, or a later job already caught up with the image
+    if product is not None and product.image and not is_current(product):
+        generate_variants(product)
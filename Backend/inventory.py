@@ -0,0 +1,164 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import Order, Product, StockAlert, StockReservation
+from .rollups import ORDER_STATE_FIELDS, OrderState, queue_order_changes
+
+
+def reservation_ttl():
+    return timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_MINUTES', 15))
+
+
+class InsufficientStock(Exception):
+    def __init__(self, products):
+        self.products = products
+        names = ', '.join(product.name for product in products)
+        super().__init__(f"Insufficient stock for {names}")
+
+
+def _per_product(quantities):
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def decrement_stock(quantities):
+    """
+    Atomically take ``{product_id: quantity}`` out of stock with one UPDATE.
+
+    Every row is guarded by ``stock >= quantity``, so concurrent callers can
+    never drive stock negative. Either all products are decremented or none
+    are and InsufficientStock is raised.
+    """
+    quantities = {pk: qty for pk, qty in quantities.items() if qty}
+    if not quantities:
+        return
+    guard = Q()
+    for product_id, quantity in quantities.items():
+        guard |= Q(pk=product_id, stock__gte=quantity)
+
+    try:
+        with transaction.atomic():
+            updated = Product.objects.filter(guard).update(
+                stock=F('stock') - _per_product(quantities), updated_at=timezone.now()
+            )
+            if updated != len(quantities):
+                raise InsufficientStock([])
+    except InsufficientStock:
+        short = [
+            product for product in Product.objects.filter(pk__in=quantities)
+            if product.stock < quantities[product.pk]
+        ]
+        raise InsufficientStock(short)
+
+    record_low_stock(quantities)
+
+
+def record_low_stock(quantities):
+    """ Write a StockAlert for each product that the last decrement took to or below its threshold """
+    low = Product.objects.filter(
+        pk__in=quantities, stock__lte=F('low_stock_threshold')
+    ).values_list('pk', 'stock', 'low_stock_threshold')
+    StockAlert.objects.bulk_create([
+        StockAlert(product_id=pk, stock=stock, threshold=threshold)
+        for pk, stock, threshold in low
+        if stock + quantities[pk] > threshold
+    ])
+
+
+def increment_stock(quantities):
+    quantities = {pk: qty for pk, qty in quantities.items() if qty}
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(
+            stock=F('stock') + _per_product(quantities), updated_at=timezone.now()
+        )
+
+
+def reserve_stock(order, lines):
+    """
+    Hold stock for a new order until it is paid or the reservation expires.
+
+    ``lines`` is an iterable of ``(product_id, quantity)``. Stock is taken
+    immediately so other shoppers cannot buy it; release_expired_reservations
+    gives it back if payment never arrives.
+    """
+    quantities = {}
+    for product_id, quantity in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    decrement_stock(quantities)
+
+    expires_at = timezone.now() + reservation_ttl()
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in quantities.items()
+    ])
+
+
+def commit_reservations(order):
+    """
+    Turn an order's held stock into a sale. Orders placed without a
+    reservation have their stock taken now, under the same guard.
+    """
+    if order.reservations.filter(status='active').update(status='committed'):
+        return
+    if order.reservations.filter(status='committed').exists():
+        return
+    quantities = {}
+    for product_id, quantity in order.items.values_list('product_id', 'quantity'):
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    decrement_stock(quantities)
+
+
+def release_expired_reservations(now=None, batch_size=500):
+    """
+    Give back stock held by orders whose reservation expired before payment
+    and cancel those orders. Returns the number of orders released.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            order_ids = list(
+                StockReservation.objects.filter(status='active', expires_at__lte=now)
+                .values_list('order_id', flat=True)
+                .distinct()[:batch_size]
+            )
+            # Lock the orders so a concurrent confirm_payment either commits
+            # the reservations first or waits for the release; orders it
+            # already holds are left for the next run
+            orders = {
+                pk: OrderState(*state) for pk, *state in
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(pk__in=order_ids)
+                .values_list('pk', *ORDER_STATE_FIELDS)
+            }
+            if not orders:
+                return released
+
+            paid = [pk for pk, state in orders.items() if state.payment_status in ('completed', 'refunded')]
+            unpaid = [pk for pk in orders if pk not in paid]
+
+            reservations = StockReservation.objects.filter(order_id__in=unpaid, status='active')
+            quantities = {}
+            for product_id, quantity in reservations.values_list('product_id', 'quantity'):
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+            increment_stock(quantities)
+            reservations.update(status='released')
+            StockReservation.objects.filter(order_id__in=paid, status='active').update(status='committed')
+            Order.objects.filter(pk__in=unpaid).update(
+                status='cancelled', payment_status='failed', updated_at=now
+            )
+            queue_order_changes([
+                (orders[pk], orders[pk]._replace(status='cancelled', payment_status='failed'))
+                for pk in unpaid
+            ])
+            released += len(unpaid)
+
+        if len(order_ids) < batch_size:
+            return released
@@ -0,0 +1,183 @@
+"""
+Database-backed job queue.
+
+``enqueue`` writes a Job row in the caller's transaction, so a job exists
+exactly when the change that needs it commits. ``manage.py run_jobs``
+claims due jobs (``SELECT ... FOR UPDATE SKIP LOCKED`` where the database
+supports it), runs them on a thread or process pool and retries failures
+with exponential backoff. No broker is involved.
+"""
+import multiprocessing
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+# Task name -> function, filled by the @task decorator at import time
+TASKS = {}
+
+
+def job_max_attempts():
+    return getattr(settings, 'JOB_MAX_ATTEMPTS', 5)
+
+
+def job_timeout():
+    """ How long a job may stay claimed before it is presumed lost with its worker """
+    return timedelta(seconds=getattr(settings, 'JOB_TIMEOUT_SECONDS', 600))
+
+
+def job_retention():
+    return timedelta(days=getattr(settings, 'JOB_RETENTION_DAYS', 7))
+
+
+def task(func):
+    """ Register ``func`` so it can be enqueued; its arguments must be JSON-serializable """
+    func.task_name = f'{func.__module__}.{func.__name__}'
+    TASKS[func.task_name] = func
+    return func
+
+
+def enqueue(func, delay=None, max_attempts=None, **kwargs):
+    """ Queue ``func(**kwargs)``; it becomes visible to workers when the current transaction commits """
+    return Job.objects.create(
+        task=func.task_name,
+        payload=kwargs,
+        run_at=timezone.now() + (delay or timedelta()),
+        max_attempts=max_attempts or job_max_attempts(),
+    )
+
+
+def retry_delay(attempts):
+    """ Exponential backoff with jitter: about 10s, 20s, 40s, ... capped at an hour """
+    base = getattr(settings, 'JOB_RETRY_SECONDS', 10)
+    seconds = min(base * 2 ** (attempts - 1), 3600)
+    return timedelta(seconds=seconds * random.uniform(1, 1.25))
+
+
+def claim_jobs(worker, limit, now=None):
+    """ Mark up to ``limit`` due jobs as running for ``worker``; returns their ids """
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = Job.objects.filter(status='queued', run_at__lte=now).order_by('run_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            # Rows other workers are claiming right now are skipped, not waited on
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('id', flat=True)[:limit])
+        # Without SKIP LOCKED (SQLite) writers are serialized and the status
+        # guard makes a job claimed by someone else drop out here
+        Job.objects.filter(pk__in=ids, status='queued').update(
+            status='running', locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+        )
+        return list(Job.objects.filter(pk__in=ids, status='running', locked_by=worker, locked_at=now)
+                    .values_list('id', flat=True))
+
+
+def run_job(job_id):
+    """
+    Run one claimed job. Its database writes commit together with the job
+    being marked done, so a crash can't apply them twice. A run that outlived
+    JOB_TIMEOUT_SECONDS and lost its claim to another worker rolls its writes
+    back instead. Returns True on success.
+    """
+    job = Job.objects.get(pk=job_id)
+    # Still this run's job only while the claim it started with is in place
+    claim = Job.objects.filter(pk=job.pk, status='running', locked_by=job.locked_by, locked_at=job.locked_at)
+    try:
+        func = TASKS.get(job.task)
+        if func is None:
+            raise LookupError(f'Unknown task {job.task}')
+        with transaction.atomic():
+            func(**job.payload)
+            if not claim.update(status='done', finished_at=timezone.now(), last_error=''):
+                transaction.set_rollback(True)
+                return False
+        return True
+    except Exception:
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            outcome = {'status': 'queued', 'run_at': now + retry_delay(job.attempts)}
+        else:
+            outcome = {'status': 'failed', 'finished_at': now}
+        claim.update(last_error=traceback.format_exc(), **outcome)
+        return False
+
+
+def _run_pooled(job_id):
+    try:
+        return run_job(job_id)
+    finally:
+        # Pool threads and processes outlive the job, like request threads
+        close_old_connections()
+
+
+def requeue_stale_jobs(now=None):
+    """ Put back jobs whose worker died mid-run; the lost attempt still counts """
+    now = now or timezone.now()
+    return Job.objects.filter(status='running', locked_at__lt=now - job_timeout()).update(
+        status='queued', run_at=now, last_error='Worker timed out',
+    )
+
+
+def purge_finished_jobs(now=None):
+    """ Delete successful jobs older than JOB_RETENTION_DAYS; failed ones are kept for inspection """
+    now = now or timezone.now()
+    deleted, _ = Job.objects.filter(status='done', finished_at__lt=now - job_retention()).delete()
+    return deleted
+
+
+def _make_pool(kind, concurrency):
+    if kind == 'process':
+        # Spawned children set Django up from scratch instead of sharing
+        # the parent's database connections through fork
+        return ProcessPoolExecutor(concurrency, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=django.setup)
+    return ThreadPoolExecutor(concurrency, thread_name_prefix='job')
+
+
+def work(worker, concurrency=4, pool='thread', poll_interval=1.0, once=False, stop=None):
+    """
+    Claim and run jobs until ``stop`` (a threading.Event) is set, or with
+    ``once`` until no due job is left. Returns ``(succeeded, failed)``.
+    """
+    stop = stop or threading.Event()
+    succeeded = failed = 0
+    running = set()
+    maintained = 0.0
+    with _make_pool(pool, concurrency) as executor:
+        while not stop.is_set():
+            if time.monotonic() - maintained > 60:
+                requeue_stale_jobs()
+                purge_finished_jobs()
+                maintained = time.monotonic()
+
+            claimed = claim_jobs(worker, concurrency - len(running)) if len(running) < concurrency else []
+            running.update(executor.submit(_run_pooled, job_id) for job_id in claimed)
+            if not running:
+                if once:
+                    break
+                stop.wait(poll_interval)
+                continue
+
+            done, running = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.result():
+                    succeeded += 1
+                else:
+                    failed += 1
+
+        for future in wait(running).done:
+            if future.result():
+                succeeded += 1
+            else:
+                failed += 1
+    return succeeded, failed
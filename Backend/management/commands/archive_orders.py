@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from Backend.archive import archive_age, archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Move delivered and cancelled orders older than ORDER_ARCHIVE_DAYS to the archive tables (run from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help='Archive orders older than this many days instead of ORDER_ARCHIVE_DAYS')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        age = timedelta(days=options['days']) if options['days'] is not None else archive_age()
+        archived = archive_orders(before=timezone.now() - age, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} orders'))
@@ -0,0 +1,17 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from Backend.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales rollups used by the analytics endpoint from the order table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat,
+                            help='Only rebuild days from this date (YYYY-MM-DD) onwards')
+
+    def handle(self, *args, **options):
+        days = rebuild_rollups(since=options['since'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt sales rollups for {days} days'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from Backend.images import generate_variants, is_current
+from Backend.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP variants for product images that have none, or outdated ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate variants for every product image')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').only('id', 'image', 'image_variants')
+        generated = failed = 0
+        for product in products.iterator():
+            if is_current(product) and not options['force']:
+                continue
+            try:
+                generate_variants(product)
+            except (OSError, ValueError) as exc:
+                failed += 1
+                self.stderr.write(f'Product {product.pk} ({product.image.name}): {exc}')
+                continue
+            generated += 1
+        self.stdout.write(self.style.SUCCESS(f'Generated variants for {generated} products, {failed} failed'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Backend.transfer import IMPORT_BATCH_SIZE, IMPORT_FORMATS, import_format, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Create or update products from a CSV or JSON-lines catalog file, matching on SKU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Catalog file (.csv, .jsonl)')
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                            help='File format; guessed from the extension by default')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help='Products written per bulk_create / bulk_update')
+
+    def handle(self, *args, **options):
+        try:
+            stream = open(options['path'], 'rb')
+        except OSError as exc:
+            raise CommandError(exc)
+
+        with stream:
+            format = import_format(options['path'], options['format'])
+            result = import_products(read_rows(stream, format), batch_size=options['batch_size'])
+
+        for error in result['errors']:
+            self.stderr.write(f"line {error['line']}: {error['errors']}")
+        if result['failed'] > len(result['errors']):
+            self.stderr.write(f"... and {result['failed'] - len(result['errors'])} more invalid rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['created']}, updated {result['updated']}, skipped {result['failed']} invalid rows"
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from Backend.counters import rebuild_product_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized active product count of every category'
+
+    def add_arguments(self, parser):
+        parser.add_argument('category_ids', nargs='*', type=int,
+                            help='Only rebuild these categories')
+
+    def handle(self, *args, **options):
+        updated = rebuild_product_counts(options['category_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt product counts for {updated} categories'))
@@ -0,0 +1,38 @@
+import os
+import signal
+import socket
+import threading
+
+from django.core.management.base import BaseCommand
+
+from Backend.jobs import work
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (image variants, sales rollups) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Jobs run at the same time')
+        parser.add_argument('--pool', choices=['thread', 'process'], default='thread',
+                            help='Run jobs on threads, or on processes for CPU-bound work')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no job is due instead of waiting for more')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        # Finish the jobs in hand on SIGTERM / Ctrl-C, claim no new ones
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: stop.set())
+
+        succeeded, failed = work(
+            f'{socket.gethostname()}:{os.getpid()}',
+            concurrency=options['concurrency'],
+            pool=options['pool'],
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+            stop=stop,
+        )
+        self.stdout.write(self.style.SUCCESS(f'{succeeded} jobs succeeded, {failed} attempts failed'))
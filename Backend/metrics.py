@@ -0,0 +1,144 @@
+"""
+Per-endpoint request metrics in Prometheus text format.
+
+Each worker process aggregates into a plain dict guarded by a lock. When
+``METRICS_MULTIPROC_DIR`` is set (setting or environment variable), every
+worker also writes its totals to ``<dir>/metrics-<pid>.json`` at most every
+``METRICS_FLUSH_SECONDS`` and the export merges all files, so any worker can
+answer for the whole server.
+"""
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Layout of one series: fixed counters followed by one slot per bucket
+REQUESTS, LATENCY_SUM, QUERIES, DB_SECONDS, RESPONSE_BYTES = range(5)
+FIRST_BUCKET = 5
+
+
+def multiproc_dir():
+    return getattr(settings, 'METRICS_MULTIPROC_DIR', None) or os.environ.get('METRICS_MULTIPROC_DIR')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}   # (route, method) -> list of counters
+        self._last_flush = 0.0
+
+    def observe(self, route, method, duration, queries, db_seconds, response_bytes):
+        with self._lock:
+            series = self._series.get((route, method))
+            if series is None:
+                series = self._series[(route, method)] = [0] * (FIRST_BUCKET + len(BUCKETS))
+            series[REQUESTS] += 1
+            series[LATENCY_SUM] += duration
+            series[QUERIES] += queries
+            series[DB_SECONDS] += db_seconds
+            series[RESPONSE_BYTES] += response_bytes
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    series[FIRST_BUCKET + i] += 1
+                    break
+        self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def flush(self, force=False):
+        directory = multiproc_dir()
+        if not directory:
+            return
+        interval = getattr(settings, 'METRICS_FLUSH_SECONDS', 5)
+        now = time.monotonic()
+        if not force and now - self._last_flush < interval:
+            return
+        self._last_flush = now
+
+        payload = [[route, method, series] for (route, method), series in self.snapshot().items()]
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as fh:
+            json.dump(payload, fh)
+        os.replace(tmp_path, path)
+
+    def collect(self):
+        """ Totals for this process, or for every worker in multiprocess mode """
+        directory = multiproc_dir()
+        if not directory:
+            return self.snapshot()
+
+        self.flush(force=True)
+        merged = {}
+        for name in os.listdir(directory):
+            if not (name.startswith('metrics-') and name.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as fh:
+                    payload = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            for route, method, series in payload:
+                total = merged.setdefault((route, method), [0] * len(series))
+                for i, value in enumerate(series):
+                    total[i] += value
+        return merged
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        series = sorted(self.collect().items())
+
+        family('http_requests_total', 'counter', 'Requests handled, by route and method.')
+        for (route, method), values in series:
+            lines.append(f'http_requests_total{_labels(route, method)} {values[REQUESTS]}')
+
+        family('http_request_duration_seconds', 'histogram', 'Request latency, by route and method.')
+        for (route, method), values in series:
+            cumulative = 0
+            for i, bound in enumerate(BUCKETS):
+                cumulative += values[FIRST_BUCKET + i]
+                lines.append(f'http_request_duration_seconds_bucket{_labels(route, method, le=bound)} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{_labels(route, method, le="+Inf")} {values[REQUESTS]}')
+            lines.append(f'http_request_duration_seconds_sum{_labels(route, method)} {values[LATENCY_SUM]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{_labels(route, method)} {values[REQUESTS]}')
+
+        family('http_request_db_queries_total', 'counter', 'SQL queries issued while handling requests.')
+        for (route, method), values in series:
+            lines.append(f'http_request_db_queries_total{_labels(route, method)} {values[QUERIES]}')
+
+        family('http_request_db_seconds_total', 'counter', 'Time spent executing SQL while handling requests.')
+        for (route, method), values in series:
+            lines.append(f'http_request_db_seconds_total{_labels(route, method)} {values[DB_SECONDS]:.6f}')
+
+        family('http_response_bytes_total', 'counter', 'Response body bytes sent.')
+        for (route, method), values in series:
+            lines.append(f'http_response_bytes_total{_labels(route, method)} {values[RESPONSE_BYTES]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(route, method, **extra):
+    labels = {'route': route, 'method': method, **extra}
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,216 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+from .metrics import registry
+from .routers import pin_to_primary
+
+try:
+    import brotli
+except ImportError:  # optional: responses are gzipped instead
+    brotli = None
+
+# Dynamic responses: a fast brotli level still beats gzip on JSON
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+
+class QueryTimer:
+    """ Counts the queries and their time for one request """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - start
+
+
+# The current request's timer. A context variable, so it follows an async
+# view's queries into the threads sync_to_async runs them on, each of which
+# has its own connection objects.
+_query_timer = ContextVar('query_timer', default=None)
+
+
+def _timed_execute(execute, sql, params, many, context):
+    timer = _query_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def _install(connection):
+    if _timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_timed_execute)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    _install(connection)
+
+
+@contextmanager
+def timing_queries():
+    """ A QueryTimer receiving the queries of the current context """
+    # Connections opened before this module was imported
+    for connection in connections.all(initialized_only=True):
+        _install(connection)
+    timer = QueryTimer()
+    token = _query_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _query_timer.reset(token)
+
+
+class HybridMiddleware:
+    """
+    Base for middleware that runs in both the WSGI and the ASGI stack.
+    Under ASGI Django hands it an async ``get_response`` and awaits it,
+    instead of pushing every request (async views included) through a
+    thread. Subclasses post-process in ``process_response``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        return response
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    Records request count, latency, SQL queries / time and response size
+    per resolved route (URL name) and method; exported by /api/metrics.
+    """
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with timing_queries() as timer:
+            response = self.get_response(request)
+        return self.record(request, response, timer, start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with timing_queries() as timer:
+            response = await self.get_response(request)
+        return self.record(request, response, timer, start)
+
+    def record(self, request, response, timer, start):
+        duration = time.perf_counter() - start
+        match = getattr(request, 'resolver_match', None)
+        route = (match.view_name or match.route) if match else 'unresolved'
+        size = 0 if response.streaming else len(response.content)
+        registry.observe(route, request.method, duration, timer.queries, timer.seconds, size)
+        return response
+
+
+class PrimaryPinMiddleware(HybridMiddleware):
+    """
+    Pins a user's reads to the primary database for a short while after a
+    successful write (see Backend.routers), so the next page shows it.
+    """
+
+    def process_response(self, request, response):
+        # DRF copies the token-authenticated user onto the Django request
+        user = getattr(request, 'user', None)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 and user is not None:
+            pin_to_primary(user)
+        return response
+
+
+def compress_min_bytes():
+    return getattr(settings, 'COMPRESS_MIN_BYTES', 1024)
+
+
+def accepted_encodings(header):
+    """ 'gzip;q=0.5, br' -> {'gzip': 0.5, 'br': 1.0} """
+    encodings = {}
+    for part in header.split(','):
+        coding, *params = [token.strip() for token in part.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        encodings[coding.lower()] = quality
+    return encodings
+
+
+def choose_encoding(header):
+    """ 'br' or 'gzip', whichever the client prefers of those available, or None """
+    accepted = accepted_encodings(header)
+    best, best_quality = None, 0
+    # On a tie the first one wins
+    for coding in (('br', 'gzip') if brotli else ('gzip',)):
+        quality = accepted.get(coding, accepted.get('*', 0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class CompressionMiddleware(HybridMiddleware):
+    """
+    Compresses JSON and text responses of at least COMPRESS_MIN_BYTES
+    (default 1 KiB) with brotli, when it is installed, or gzip, as the
+    client's Accept-Encoding prefers. Smaller bodies aren't worth the CPU.
+    """
+
+    def process_response(self, request, response):
+        if (response.streaming or response.has_header('Content-Encoding')
+                or len(response.content) < compress_min_bytes()
+                or not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+        if encoding == 'br':
+            compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        else:
+            compressed = compress_string(response.content)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The bytes differ from the identity body's, the representation doesn't
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
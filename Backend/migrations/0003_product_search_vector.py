@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:02
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+BACKFILL_SQL = """
+UPDATE "Backend_product" AS p SET search_vector =
+    setweight(to_tsvector('english', coalesce(p.name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(c.name, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(p.description, '')), 'C')
+FROM "Backend_category" AS c
+WHERE c.id = p.category_id
+"""
+
+
+def build_search_index(apps, schema_editor):
+    # Full-text search is Postgres only; other backends use the in-process index
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(BACKFILL_SQL)
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS product_search_vector_idx '
+        'ON "Backend_product" USING gin (search_vector)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS product_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Backend', '0002_product_catalog_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(build_search_index, drop_search_index),
+    ]
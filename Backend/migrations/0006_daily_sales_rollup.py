@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:08
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    Order = apps.get_model('Backend', 'Order')
+    DailySalesRollup = apps.get_model('Backend', 'DailySalesRollup')
+    days = (
+        Order.objects.annotate(day=TruncDate('created_at'))
+        .order_by()
+        .values('day')
+        .annotate(
+            revenue=Sum('total_amount', filter=Q(payment_status='completed')),
+            order_count=Count('id'),
+            pending_count=Count('id', filter=Q(status='pending')),
+            paid_order_count=Count('id', filter=Q(payment_status='completed')),
+        )
+    )
+    DailySalesRollup.objects.bulk_create([
+        DailySalesRollup(
+            date=day['day'],
+            revenue=day['revenue'] or 0,
+            order_count=day['order_count'],
+            pending_count=day['pending_count'],
+            paid_order_count=day['paid_order_count'],
+        )
+        for day in days
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Backend', '0005_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('pending_count', models.PositiveIntegerField(default=0)),
+                ('paid_order_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
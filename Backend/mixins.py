@@ -0,0 +1,108 @@
+import hashlib
+from operator import attrgetter
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from .routers import is_pinned, read_from_replicas
+
+
+class ConditionalGetMixin:
+    """
+    Strong ETag validation for ``list`` and ``retrieve``, plus Last-Modified
+    for ``retrieve``.
+
+    ``conditional_timestamps`` names the ``updated_at`` lookups that change
+    whenever the serialized representation does. A list is validated by one
+    aggregate (row count plus the newest timestamps) and a detail by the
+    object's own timestamps, so a matching If-None-Match (or, for a detail,
+    If-Modified-Since) gets a 304 without serializing anything.
+    """
+    conditional_timestamps = ('updated_at',)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        stamps = queryset.order_by().aggregate(
+            rows=Count('pk'),
+            **{f'stamp_{i}': Max(lookup) for i, lookup in enumerate(self.conditional_timestamps)}
+        )
+        timestamps = [stamps[f'stamp_{i}'] for i in range(len(self.conditional_timestamps))]
+        # No Last-Modified: deleting or deactivating a row shrinks the list
+        # without moving the newest timestamp, only the count in the ETag
+        return self.conditional_response(
+            request, [stamps['rows'], *timestamps],
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        timestamps = [
+            attrgetter(lookup.replace('__', '.'))(instance) for lookup in self.conditional_timestamps
+        ]
+        return self.conditional_response(
+            request, [instance.pk, *timestamps],
+            lambda: Response(self.get_serializer(instance).data),
+            last_modified=int(max(timestamps).timestamp()),
+        )
+
+    def conditional_response(self, request, versions, render, last_modified=None):
+        # The path (with its query string) is part of the tag: filters and
+        # cursors produce different bodies from the same rows
+        key = '|'.join([request.get_full_path(), *map(str, versions)])
+        etag = quote_etag(hashlib.sha1(key.encode()).hexdigest())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = render()
+        if 200 <= response.status_code < 300 or response.status_code == 304:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, no_cache=True)
+        return response
+
+
+class SparseRetrieveMixin:
+    """
+    Loads only the columns a ``retrieve`` with a sparse fieldset
+    (Backend.fieldsets) renders, plus the ``conditional_timestamps`` its
+    validators read. For viewsets with a compiled serializer; lists read
+    ``.values(*row_columns)`` instead.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'retrieve':
+            return queryset
+        serializer = self.get_serializer()
+        if serializer.selected_fields is None:
+            return queryset
+        return queryset.only(*serializer.row_columns, *self.conditional_timestamps)
+
+
+class ReplicaReadMixin:
+    """
+    Runs safe requests against the read replicas (Backend.routers), unless
+    the user wrote recently. ``replica_actions`` limits it to some actions;
+    None means every safe one.
+    """
+    replica_actions = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._replica_context = None
+        if (request.method in SAFE_METHODS
+                and (self.replica_actions is None or self.action in self.replica_actions)
+                and not is_pinned(request.user)):
+            self._replica_context = read_from_replicas()
+            self._replica_context.__enter__()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        context = getattr(self, '_replica_context', None)
+        if context is not None:
+            self._replica_context = None
+            context.__exit__(None, None, None)
+        return super().finalize_response(request, response, *args, **kwargs)
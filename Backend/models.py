@@ -2,13 +2,24 @@ from django.db import models
 
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
+from django.db.models import (
+    Count, DecimalField, ExpressionWrapper, F, IntegerField, OuterRef, Prefetch, Subquery, Sum, Value, Window,
+)
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
 
 
 class Category(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
+    # Active products in this category, maintained by Backend.signals
+    active_product_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Also bumped when active_product_count changes, so it versions the API representation
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name_plural = 'Categories'
@@ -19,18 +30,40 @@ class Category(models.Model):
 
 
 class Product(models.Model):
+    # Natural key used by catalog imports (Backend.transfer) to match existing rows
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=255)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='products/')
+    # {'source': image name, 'widths': {width: file name}}, written by Backend.images
+    image_variants = models.JSONField(default=dict, editable=False)
     stock = models.PositiveIntegerField(default=0)
+    low_stock_threshold = models.PositiveIntegerField(default=10)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by Backend.search on Postgres (GIN-indexed), unused elsewhere
+    search_vector = SearchVectorField(null=True, editable=False)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Supports the keyset-paginated catalog (CatalogCursorPagination)
+            models.Index(fields=['-created_at', 'id'], name='product_catalog_idx',
+                         condition=models.Q(is_active=True)),
+            # Only the (few) active products at or below their threshold
+            models.Index(fields=['stock'], name='product_low_stock_idx',
+                         condition=models.Q(is_active=True, stock__lte=models.F('low_stock_threshold'))),
+            # min_price / max_price, alone or within a category
+            models.Index(fields=['price'], name='product_price_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['category', 'price'], name='product_category_price_idx',
+                         condition=models.Q(is_active=True)),
+            # The in_stock catalog, in catalog order
+            models.Index(fields=['-created_at', 'id'], name='product_in_stock_idx',
+                         condition=models.Q(is_active=True, stock__gt=0)),
+        ]
     
     def __str__(self):
         return self.name
@@ -47,20 +80,38 @@ class Cart(models.Model):
     
     def __str__(self):
         return f'Cart - {self.user.username}'
+
+    @cached_property
+    def snapshot_items(self):
+        """ Cart lines with product and category, subtotals and cart total from a single query """
+        return list(self.items.with_totals())
     
     @property
     def total_price(self):
-        return sum(items.subtotal for items in self.items.all())
+        items = self.snapshot_items
+        return items[0].cart_total if items else 0
     
     @property
     def total_items(self):
         return sum(items.quantity for items in self.items.all())
 
 
+class CartItemQuerySet(models.QuerySet):
+    def with_totals(self):
+        subtotal = ExpressionWrapper(F('product__price') * F('quantity'),
+                                     output_field=DecimalField(max_digits=10, decimal_places=2))
+        return self.select_related('product__category').annotate(
+            line_subtotal=subtotal,
+            cart_total=Window(Sum(subtotal), partition_by=[F('cart_id')]),
+        ).order_by('id')
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)])
+
+    objects = CartItemQuerySet.as_manager()
     
     class Meta:
         unique_together = ['cart', 'product']
@@ -73,6 +124,56 @@ class CartItem(models.Model):
         return self.product.price * self.quantity
 
 
+class OrderQuerySet(models.QuerySet):
+    def for_list(self, fields=None):
+        """
+        Columns for OrderListSerializer: no item rows, no user row. With a
+        sparse fieldset, only those of ``fields``.
+        """
+        annotations = {'user_email': F('user__email'), 'item_count': self._item_count()}
+        if fields is None:
+            return self.annotate(**annotations)
+        return self.annotate(
+            **{name: value for name, value in annotations.items() if name in fields}
+        ).only(*self._columns(fields))
+
+    def with_details(self, fields=None):
+        """
+        Prefetch plan for OrderSerializer: a fixed number of queries per page.
+        A sparse ``fields`` skips the joins and columns it leaves out.
+        """
+        queryset = self
+        if fields is None or 'user_email' in fields:
+            queryset = queryset.select_related('user')
+        if fields is None or 'items' in fields:
+            item_model = self.model._meta.get_field('items').related_model
+            queryset = queryset.prefetch_related(
+                Prefetch('items', queryset=item_model.objects.select_related('product'))
+            )
+        if fields is None:
+            return queryset
+        related = ['user', 'user__email'] if 'user_email' in fields else []
+        return queryset.only(*self._columns(fields), *related)
+
+    def _item_count(self):
+        # Counted per row, not by GROUP BY over a join with the items: the
+        # page's ORDER BY ... LIMIT can then stop early on the created_at index
+        item_model = self.model._meta.get_field('items').related_model
+        counts = (
+            item_model.objects.filter(order=OuterRef('pk'))
+            .order_by()
+            .values('order')
+            .annotate(n=Count('pk'))
+            .values('n')
+        )
+        return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+    def _columns(self, fields):
+        # created_at is the pagination cursor
+        concrete = {field.name for field in self.model._meta.concrete_fields}
+        return [name for name in fields if name in concrete] + ['created_at']
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -105,9 +206,16 @@ class Order(models.Model):
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = OrderQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Back the OrderCursorPagination scans for staff and for a single user
+            models.Index(fields=['-created_at', 'id'], name='order_created_idx'),
+            models.Index(fields=['user', '-created_at', 'id'], name='order_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"Order #{self.id} - {self.user.username}"
@@ -127,6 +235,162 @@ class OrderItem(models.Model):
         return self.price * self.quantity
 
 
+class ArchivedOrder(models.Model):
+    """
+    A delivered or cancelled order moved out of Order by Backend.archive.
+    Keeps the original id, and the timestamps as they were.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    payment_status = models.CharField(max_length=20, choices=Order.PAYMENT_STATUS_CHOICES)
+    shipping_address = models.TextField()
+    shipping_city = models.CharField(max_length=100)
+    shipping_zip = models.CharField(max_length=20)
+    shipping_country = models.CharField(max_length=100)
+    stripe_payment_intent = models.CharField(max_length=200, blank=True)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    tax_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', 'id'], name='archived_order_created_idx'),
+            models.Index(fields=['user', '-created_at', 'id'], name='archived_order_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived order #{self.id}"
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='archived_order_items')
+    quantity = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.product_id} x {self.quantity}"
+
+    @property
+    def subtotal(self):
+        return self.price * self.quantity
+
+
+class DailySalesRollup(models.Model):
+    """ Per-day order totals read by the analytics endpoint, maintained by Backend.rollups """
+    date = models.DateField(unique=True)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # completed payments only
+    order_count = models.PositiveIntegerField(default=0)
+    pending_count = models.PositiveIntegerField(default=0)
+    paid_order_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+
+    def __str__(self):
+        return f"Sales {self.date}: {self.revenue} ({self.order_count} orders)"
+
+
+class StockAlert(models.Model):
+    """ Written when a sale takes a product's stock down to its low-stock threshold """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_alerts')
+    stock = models.PositiveIntegerField()
+    threshold = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.product_id}: {self.stock} left (threshold {self.threshold})"
+
+
+class StockReservation(models.Model):
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for order #{self.order_id} ({self.status})"
+
+
+class Job(models.Model):
+    """ Deferred work run by ``manage.py run_jobs``; see Backend.jobs """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    task = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=200, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The claim query: due jobs in run_at order, ignoring the finished backlog
+            models.Index(fields=['run_at', 'id'], name='job_due_idx',
+                         condition=models.Q(status='queued')),
+        ]
+
+    def __str__(self):
+        return f"Job #{self.id} {self.task} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """ A client's Idempotency-Key and the response it got; see Backend.idempotency """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    # sha256 of the method, path and body the key was first used with
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} for user #{self.user_id}"
+
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     phone = models.CharField(max_length=20, blank=True)
@@ -168,5 +432,22 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    def __str__(self):
+        return f"Payment {self.transaction_id} - {self.status}"
+
+
+class ArchivedPayment(models.Model):
+    """ The Payment of an ArchivedOrder, moved with it by Backend.archive """
+    id = models.BigIntegerField(primary_key=True)
+    order = models.OneToOneField(ArchivedOrder, on_delete=models.CASCADE, related_name='payment')
+    transaction_id = models.CharField(max_length=100, unique=True)
+    payment_method = models.CharField(max_length=20, choices=Payment.PAYMENT_METHOD_CHOICES)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=Payment.PAYMENT_STATUS_CHOICES)
+    card_number = models.CharField(max_length=4, blank=True)
+    card_holder_name = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
     def __str__(self):
         return f"Payment {self.transaction_id} - {self.status}"
\ No newline at end of file
@@ -0,0 +1,53 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class CatalogCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the product catalog.
+
+    Pages are located with a ``created_at`` cursor instead of an OFFSET, so
+    page 500 costs the same index range scan as page 1. The catalog stays a
+    plain list unless the client asks for a page with ``cursor`` or
+    ``page_size``.
+    """
+    ordering = ('-created_at', 'id')
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class SearchPagination(LimitOffsetPagination):
+    """
+    Pages of product search results, which come in relevance order that a
+    ``created_at`` cursor can't express. Always paginated, so a broad term
+    never returns the whole catalog; offsets stop at ``max_offset``, as
+    nobody reads that deep into a ranked list.
+    """
+    default_limit = 24
+    limit_query_param = 'page_size'
+    max_limit = 100
+    max_offset = 1000
+
+    def get_offset(self, request):
+        return min(super().get_offset(request), self.max_offset)
+
+    def get_next_link(self):
+        # A next offset past max_offset would be clamped back onto a page
+        # already served, and a client following the links would never stop
+        if self.offset + self.limit > self.max_offset:
+            return None
+        return super().get_next_link()
+
+
+class OrderCursorPagination(CursorPagination):
+    """ Keyset pagination for order lists, newest first """
+    ordering = ('-created_at', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
@@ -0,0 +1,34 @@
+"""
+JSON rendering through orjson, when it is installed.
+
+orjson encodes in C and writes UTF-8 bytes directly. FastJSONRenderer
+produces the same bytes as DRF's JSONRenderer for compact output, and
+hands anything orjson can't reproduce (indented output, ASCII-only
+settings) back to the stdlib renderer.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib renderer is used instead
+    orjson = None
+
+# Dates and times go through DRF's encoder, which writes UTC as 'Z'
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        encoder = self.encoder_class()
+        try:
+            ret = orjson.dumps(data, default=encoder.default, option=ORJSON_OPTIONS)
+        except TypeError:
+            # Out of orjson's range (e.g. integers beyond 64 bits)
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escaping as JSONRenderer, to stay a strict JavaScript subset
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
@@ -0,0 +1,151 @@
+"""
+Compiled representations of the hot read models.
+
+A DRF ModelSerializer builds each row through a model instance and one
+bound Field per column. Once the catalog and cart queries are fixed,
+that is where their CPU time goes. The tables here map each output
+field of ProductSerializer, CategorySerializer and CartSerializer to the
+``.values()`` columns it needs and a function building it from such a
+row. A sparse fieldset (Backend.fieldsets) then reads only the columns
+of its fields. Instances are flattened into the same row shape first.
+Backend.tests holds their output to the generic DRF one.
+"""
+from operator import attrgetter
+
+from django.core.files.storage import default_storage
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+# Shared, unbound fields for the conversions that must match DRF to the
+# character: decimal quantizing and timezone-aware ISO 8601
+_money = serializers.DecimalField(max_digits=10, decimal_places=2)
+_datetime = serializers.DateTimeField()
+
+
+def _timestamp(value):
+    return _datetime.to_representation(value) if value else None
+
+
+def file_url(name, request):
+    """ What DRF's FileField renders for a stored file name """
+    if not name:
+        return None
+    if not api_settings.UPLOADED_FILES_USE_URL:
+        return name
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def variant_urls(image, variants, request):
+    """ ``{width: url}`` of a product's WebP variants, if they were made from ``image`` """
+    if not image or variants.get('source') != image:
+        return {}
+    urls = {}
+    for width, name in variants['widths'].items():
+        url = default_storage.url(name)
+        urls[width] = request.build_absolute_uri(url) if request is not None else url
+    return urls
+
+
+def _plain(column):
+    return (column,), lambda row, request: row[column]
+
+
+def _price(column):
+    return (column,), lambda row, request: _money.to_representation(row[column])
+
+
+def _time(column):
+    return (column,), lambda row, request: _timestamp(row[column])
+
+
+# output field -> (columns, build(row, request)), in serializer field order
+PRODUCT_FIELDS = {
+    'id': _plain('id'),
+    'sku': _plain('sku'),
+    'name': _plain('name'),
+    'description': _plain('description'),
+    'price': _price('price'),
+    'category': _plain('category_id'),
+    'category_name': _plain('category__name'),
+    'stock': _plain('stock'),
+    'low_stock_threshold': _plain('low_stock_threshold'),
+    'image': (('image',), lambda row, request: file_url(row['image'], request)),
+    'image_variants': (('image', 'image_variants'),
+                       lambda row, request: variant_urls(row['image'], row['image_variants'], request)),
+    'is_active': _plain('is_active'),
+    'is_in_stock': (('stock',), lambda row, request: row['stock'] > 0),
+    'created_at': _time('created_at'),
+    'updated_at': _time('updated_at'),
+}
+
+CATEGORY_FIELDS = {
+    'id': _plain('id'),
+    'name': _plain('name'),
+    'description': _plain('description'),
+    'product_count': _plain('active_product_count'),
+    'created_at': _time('created_at'),
+}
+
+CART_ITEM_COLUMNS = ('id', 'quantity', 'line_subtotal', 'cart_total', 'product_id', 'product__name',
+                     'product__price', 'product__category_id', 'product__category__name',
+                     'product__stock', 'product__image')
+
+
+def columns(table, fields=None):
+    """ The ``.values()`` columns behind ``fields`` (default: all) of a table """
+    names = table if fields is None else fields
+    return tuple(dict.fromkeys(column for name in names for column in table[name][0]))
+
+
+def compile_fields(table, fields=None):
+    """ ``[(name, build)]`` for ``fields`` (default: all), in table order """
+    return [(name, build) for name, (_, build) in table.items() if fields is None or name in fields]
+
+
+def represent(compiled, row, request=None):
+    return {name: build(row, request) for name, build in compiled}
+
+
+_getters = {}
+
+
+def instance_row(instance, row_columns):
+    """ ``instance`` flattened like its ``.values(*row_columns)`` row """
+    row = {}
+    for column in row_columns:
+        getter = _getters.get(column)
+        if getter is None:
+            path = column.replace('__', '.')
+            # .values() gives a file field's stored name
+            getter = _getters[column] = attrgetter(path + '.name' if path.endswith('image') else path)
+        row[column] = getter(instance)
+    return row
+
+
+def cart_representation(cart, item_rows, request=None):
+    return {
+        'id': cart.id,
+        'user': cart.user_id,
+        'items': [
+            {
+                'id': row['id'],
+                'product': {
+                    'id': row['product_id'],
+                    'name': row['product__name'],
+                    'price': _money.to_representation(row['product__price']),
+                    'category': row['product__category_id'],
+                    'category_name': row['product__category__name'],
+                    'stock': row['product__stock'],
+                    'image': file_url(row['product__image'], request),
+                    'is_in_stock': row['product__stock'] > 0,
+                },
+                'quantity': row['quantity'],
+                'subtotal': _money.to_representation(row['line_subtotal']),
+            }
+            for row in item_rows
+        ],
+        'total_price': _money.to_representation(item_rows[0]['cart_total'] if item_rows else 0),
+        'created_at': _timestamp(cart.created_at),
+        'updated_at': _timestamp(cart.updated_at),
+    }
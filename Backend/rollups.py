@@ -0,0 +1,121 @@
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .jobs import enqueue, task
+from .models import ArchivedOrder, DailySalesRollup, Order
+
+OrderState = namedtuple('OrderState', ['created_at', 'status', 'payment_status', 'total_amount'])
+
+ORDER_STATE_FIELDS = list(OrderState._fields)
+COUNTERS = ['revenue', 'order_count', 'pending_count', 'paid_order_count']
+
+
+def order_state(order):
+    return OrderState(*(getattr(order, field) for field in ORDER_STATE_FIELDS))
+
+
+def _contribution(state):
+    paid = state.payment_status == 'completed'
+    return (
+        Decimal(state.total_amount) if paid else Decimal('0'),
+        1,
+        int(state.status == 'pending'),
+        int(paid),
+    )
+
+
+def record_order_changes(changes):
+    """
+    Apply ``(old_state, new_state)`` pairs to the daily rollups; either side
+    may be None for a created or deleted order. Each touched day gets one
+    UPDATE with the net change.
+    """
+    deltas = defaultdict(lambda: [Decimal('0'), 0, 0, 0])
+    for old, new in changes:
+        for state, sign in ((old, -1), (new, 1)):
+            if state is None:
+                continue
+            day = deltas[timezone.localdate(state.created_at)]
+            for i, value in enumerate(_contribution(state)):
+                day[i] += sign * value
+
+    for day, values in deltas.items():
+        if not any(values):
+            continue
+        DailySalesRollup.objects.get_or_create(date=day)
+        DailySalesRollup.objects.filter(date=day).update(
+            **{counter: F(counter) + value for counter, value in zip(COUNTERS, values)},
+            updated_at=timezone.now(),
+        )
+
+
+def _dump_state(state):
+    if state is None:
+        return None
+    return [state.created_at.isoformat(), state.status, state.payment_status, str(state.total_amount)]
+
+
+def _load_state(data):
+    if data is None:
+        return None
+    created_at, status, payment_status, total_amount = data
+    return OrderState(datetime.fromisoformat(created_at), status, payment_status, Decimal(total_amount))
+
+
+def queue_order_changes(changes):
+    """
+    Like record_order_changes, but applied by the job worker after the
+    current transaction commits, so request transactions don't hold the
+    lock on today's rollup row.
+    """
+    enqueue(apply_order_changes, changes=[[_dump_state(old), _dump_state(new)] for old, new in changes])
+
+
+@task
+def apply_order_changes(changes):
+    record_order_changes([(_load_state(old), _load_state(new)) for old, new in changes])
+
+
+def rebuild_rollups(since=None):
+    """
+    Recompute the rollups (from ``since`` onwards) with one grouped query
+    over Order and one over ArchivedOrder
+    """
+    existing = DailySalesRollup.objects.all()
+    if since is not None:
+        existing = existing.filter(date__gte=since)
+
+    totals = defaultdict(lambda: [Decimal('0'), 0, 0, 0])
+    for model in (Order, ArchivedOrder):
+        orders = model.objects.all()
+        if since is not None:
+            orders = orders.filter(created_at__date__gte=since)
+        days = (
+            orders.annotate(day=TruncDate('created_at'))
+            .order_by()
+            .values('day')
+            .annotate(
+                revenue=Sum('total_amount', filter=Q(payment_status='completed')),
+                order_count=Count('id'),
+                pending_count=Count('id', filter=Q(status='pending')),
+                paid_order_count=Count('id', filter=Q(payment_status='completed')),
+            )
+        )
+        for day in days:
+            for i, counter in enumerate(COUNTERS):
+                totals[day['day']][i] += day[counter] or 0
+
+    rows = [
+        DailySalesRollup(date=day, **dict(zip(COUNTERS, values)))
+        for day, values in sorted(totals.items())
+    ]
+    with transaction.atomic():
+        existing.delete()
+        DailySalesRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
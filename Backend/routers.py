@@ -0,0 +1,69 @@
+"""
+Read-replica routing.
+
+Reads go to a replica from ``DATABASE_REPLICAS`` only inside
+``read_from_replicas()``, which ReplicaReadMixin opens for the safe
+requests of the catalog and analytics views. Everything else (carts,
+checkout, payment, any write) stays on ``default``. A user who just
+wrote is pinned to ``default`` for ``REPLICA_PIN_SECONDS`` so they read
+their own changes despite replication lag.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def pin_seconds():
+    return getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+
+def _pin_key(user_id):
+    return f'primary-pin:{user_id}'
+
+
+def pin_to_primary(user):
+    """ Send ``user``'s reads to the primary for the next REPLICA_PIN_SECONDS """
+    if user.is_authenticated and replica_aliases():
+        cache.set(_pin_key(user.pk), True, pin_seconds())
+
+
+def is_pinned(user):
+    return user.is_authenticated and bool(replica_aliases()) and cache.get(_pin_key(user.pk), False)
+
+
+@contextmanager
+def read_from_replicas():
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    """ DATABASE_ROUTERS entry; only reads inside read_from_replicas() leave the primary """
+
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        # Inside a transaction the primary may hold rows the replicas can't see yet
+        if not replicas or not _replica_reads.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Explicitly, or related lookups would follow a replica-loaded instance
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
@@ -0,0 +1,221 @@
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, FloatField, OuterRef, Subquery, Value, When
+
+SEARCH_CONFIG = 'english'
+
+# Same relative weights Postgres uses for the A/B/C labels in ts_rank
+FIELD_WEIGHTS = {'name': 1.0, 'category': 0.4, 'description': 0.2}
+
+STOP_WORDS = frozenset(
+    'a an and are as at be by for from in is it of on or the to with'.split()
+)
+
+
+def product_search_vector(category_name):
+    """
+    Weighted tsvector for a product row: name (A), category (B), description (C).
+
+    ``category_name`` is a string or an expression resolving to one.
+    """
+    if not hasattr(category_name, 'resolve_expression'):
+        category_name = Value(category_name)
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(category_name, weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+class PostgresSearchBackend:
+    """ Full-text search over the GIN-indexed ``Product.search_vector`` column """
+
+    def search(self, queryset, term):
+        query = SearchQuery(term, config=SEARCH_CONFIG, search_type='websearch')
+        return (
+            queryset.filter(search_vector=query)
+            .annotate(rank=SearchRank(F('search_vector'), query))
+            .order_by('-rank', '-created_at', '-id')
+        )
+
+    def index_product(self, product):
+        from .models import Product
+
+        Product.objects.filter(pk=product.pk).update(
+            search_vector=product_search_vector(product.category.name)
+        )
+
+    def index_category(self, category):
+        from .models import Product
+
+        Product.objects.filter(category=category).update(
+            search_vector=product_search_vector(category.name)
+        )
+
+    def index_products(self, product_ids):
+        """ Reindex many rows in one UPDATE, e.g. after a bulk import """
+        from .models import Category, Product
+
+        category_name = Subquery(
+            Category.objects.filter(pk=OuterRef('category_id')).values('name')[:1]
+        )
+        Product.objects.filter(pk__in=product_ids).update(
+            search_vector=product_search_vector(category_name)
+        )
+
+    def remove_product(self, product_id):
+        # The row (and its vector) is already gone
+        pass
+
+
+def tokenize(text):
+    tokens = []
+    for word in re.findall(r'\w+', (text or '').lower()):
+        if word in STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class InvertedIndexSearchBackend:
+    """
+    In-process inverted index used when the database has no full-text support
+    (SQLite in development and tests).
+
+    The index is built lazily from the active catalog on the first search and
+    then kept current by the Product/Category signal handlers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self._postings = defaultdict(dict)   # token -> {product_id: weighted tf}
+        self._documents = {}                 # product_id -> (tokens, category_id)
+
+    def reset(self):
+        with self._lock:
+            self._built = False
+            self._postings.clear()
+            self._documents.clear()
+
+    def _build(self):
+        from .models import Product
+
+        self._load(Product.objects.filter(is_active=True))
+        self._built = True
+
+    def _load(self, products):
+        rows = products.values_list('id', 'name', 'description', 'category_id', 'category__name')
+        for pk, name, description, category_id, category_name in rows.iterator():
+            self._add(pk, name, description, category_id, category_name)
+
+    def _add(self, pk, name, description, category_id, category_name):
+        self._discard(pk)
+        weights = defaultdict(float)
+        for field, text in (('name', name), ('category', category_name), ('description', description)):
+            for token in tokenize(text):
+                weights[token] += FIELD_WEIGHTS[field]
+        for token, weight in weights.items():
+            self._postings[token][pk] = weight
+        self._documents[pk] = (tuple(weights), category_id)
+
+    def _discard(self, pk):
+        document = self._documents.pop(pk, None)
+        if document is None:
+            return
+        for token in document[0]:
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(pk, None)
+                if not postings:
+                    del self._postings[token]
+
+    def _score(self, term):
+        tokens = set(tokenize(term))
+        if not tokens:
+            return {}
+        # Scored under the lock too: the postings dicts are the live index,
+        # which signal handlers in other request threads keep updating
+        with self._lock:
+            if not self._built:
+                self._build()
+            postings = [self._postings.get(token, {}) for token in tokens]
+            if not all(postings):
+                return {}
+            total = max(len(self._documents), 1)
+
+            matches = set.intersection(*(set(p) for p in postings))
+            scores = {}
+            for pk in matches:
+                scores[pk] = sum(
+                    p[pk] * math.log(1 + total / len(p)) for p in postings
+                )
+            return scores
+
+    def search(self, queryset, term):
+        scores = self._score(term)
+        if not scores:
+            return queryset.none()
+        rank = Case(
+            *[When(pk=pk, then=Value(score)) for pk, score in scores.items()],
+            output_field=FloatField(),
+        )
+        return (
+            queryset.filter(pk__in=list(scores))
+            .annotate(rank=rank)
+            .order_by('-rank', '-created_at', '-id')
+        )
+
+    def index_product(self, product):
+        with self._lock:
+            if not self._built:
+                return
+            if not product.is_active:
+                self._discard(product.pk)
+                return
+            self._add(product.pk, product.name, product.description,
+                      product.category_id, product.category.name)
+
+    def index_category(self, category):
+        from .models import Product
+
+        with self._lock:
+            if not self._built:
+                return
+            stale = [pk for pk, doc in self._documents.items() if doc[1] == category.pk]
+            rows = Product.objects.filter(pk__in=stale).values_list(
+                'id', 'name', 'description', 'category_id'
+            )
+            for pk, name, description, category_id in rows:
+                self._add(pk, name, description, category_id, category.name)
+
+    def index_products(self, product_ids):
+        from .models import Product
+
+        with self._lock:
+            if not self._built:
+                return
+            for pk in product_ids:
+                self._discard(pk)
+            self._load(Product.objects.filter(pk__in=product_ids, is_active=True))
+
+    def remove_product(self, product_id):
+        with self._lock:
+            self._discard(product_id)
+
+
+_postgres_backend = PostgresSearchBackend()
+_fallback_backend = InvertedIndexSearchBackend()
+
+
+def get_search_backend():
+    if connection.vendor == 'postgresql':
+        return _postgres_backend
+    return _fallback_backend
@@ -1,7 +1,16 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
+from django.db.models import Manager, QuerySet
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .authentication import add_claims
 from .models import *
+from .fieldsets import context_params, sparse_fields
+from .representations import (
+    CART_ITEM_COLUMNS, CATEGORY_FIELDS, PRODUCT_FIELDS, cart_representation, columns, compile_fields,
+    instance_row, represent, variant_urls,
+)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -31,32 +40,151 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
     
 
-class ProductSerializer(serializers.ModelSerializer):
-    category_name = serializers.CharField(source='category.name')
+class LoginSerializer(TokenObtainPairSerializer):
+    """ Signs user id, staff flag, cart id and a credentials version into the tokens """
+
+    @classmethod
+    def get_token(cls, user):
+        cart, created = Cart.objects.get_or_create(user=user)
+        return add_claims(super().get_token(user), user, cart.id)
+
+
+class SparseFieldsMixin:
+    """
+    Narrows a read to the fields the request selects with ``?fields=`` /
+    ``?omit=`` (Backend.fieldsets). Only the serializer a view creates is
+    narrowed, not the ones nested in it, and never one validating ``data``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.selected_fields = None
+        if 'data' not in kwargs and len(args) < 2:
+            self.selected_fields = sparse_fields(context_params(self.context), self.Meta.fields)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.selected_fields is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in self.selected_fields}
+
+
+class CompiledFieldsMixin(SparseFieldsMixin):
+    """
+    Represents through a Backend.representations table instead of DRF's
+    fields; ``row_columns`` are the ``.values()`` columns the selected
+    fields need.
+    """
+    representation = None
+
+    @cached_property
+    def row_columns(self):
+        return columns(self.representation, self.selected_fields)
+
+    @cached_property
+    def compiled(self):
+        return compile_fields(self.representation, self.selected_fields)
+
+    def to_representation(self, instance):
+        row = instance if isinstance(instance, dict) else instance_row(instance, self.row_columns)
+        return represent(self.compiled, row, self.context.get('request'))
+
+
+class RowListSerializer(serializers.ListSerializer):
+    """
+    ``many=True`` for serializers with a compiled representation: an
+    unevaluated queryset is read with ``.values(*child.row_columns)``, so
+    no model instance is built for its rows.
+    """
+
+    def to_representation(self, data):
+        if isinstance(data, Manager):
+            data = data.all()
+        if isinstance(data, QuerySet) and data._result_cache is None:
+            data = data.values(*self.child.row_columns)
+        return [self.child.to_representation(item) for item in data]
+
+
+class ProductSerializer(CompiledFieldsMixin, serializers.ModelSerializer):
+    category_name = serializers.CharField(source='category.name', read_only=True)
+    image_variants = serializers.SerializerMethodField()
+    representation = PRODUCT_FIELDS
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'category', 'category_name', 
-                    'stock', 'image', 'is_active', 'is_in_stock', 'created_at', 'updated_at']
+        fields = ['id', 'sku', 'name', 'description', 'price', 'category', 'category_name', 
+                    'stock', 'low_stock_threshold', 'image', 'image_variants', 'is_active', 'is_in_stock', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
+        list_serializer_class = RowListSerializer
+
+    def validate_sku(self, value):
+        # Blank SKUs are stored as NULL so they don't collide on the unique index
+        return value or None
+
+    def get_image_variants(self, obj):
+        """ ``{width: url}`` of the WebP derivatives; empty until Backend.images has made them """
+        return variant_urls(obj.image.name, obj.image_variants, self.context.get('request'))
+
+
+class ProductImportSerializer(serializers.Serializer):
+    """
+    One row of a catalog import file (see Backend.transfer).
+
+    Categories are referenced by name and resolved against
+    ``context['categories']``; omitted optional columns keep their
+    current value on existing products and the model default on new ones.
+    """
+    sku = serializers.CharField(max_length=64)
+    name = serializers.CharField(max_length=255)
+    description = serializers.CharField(required=False, allow_blank=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    category = serializers.CharField(source='category_id')
+    image = serializers.CharField(max_length=100, required=False, allow_blank=True)
+    stock = serializers.IntegerField(min_value=0, required=False)
+    low_stock_threshold = serializers.IntegerField(min_value=0, required=False)
+    is_active = serializers.BooleanField(required=False)
+
+    def validate_category(self, value):
+        try:
+            return self.context['categories'][value]
+        except KeyError:
+            raise serializers.ValidationError(f'Unknown category "{value}".')
 
 
-class CategorySerializer(serializers.ModelSerializer):
-    product_count = serializers.SerializerMethodField()
+class StockAlertSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+
+    class Meta:
+        model = StockAlert
+        fields = ['id', 'product', 'product_name', 'stock', 'threshold', 'created_at']
+        read_only_fields = fields
+
+
+class CategorySerializer(CompiledFieldsMixin, serializers.ModelSerializer):
+    product_count = serializers.IntegerField(source='active_product_count', read_only=True)
+    representation = CATEGORY_FIELDS
     
     class Meta:
         model = Category
         fields = ['id', 'name', 'description', 'product_count', 'created_at']
         read_only_fields = ['id', 'created_at']
-    
-    def get_product_count(self, obj):
-        return obj.products.filter(is_active=True).count()
+        list_serializer_class = RowListSerializer
+
+
+class CartProductSerializer(serializers.ModelSerializer):
+    """ Compact product representation for cart lines """
+    category_name = serializers.CharField(source='category.name', read_only=True)
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'price', 'category', 'category_name', 'stock', 'image', 'is_in_stock']
+        read_only_fields = fields
 
 
 class CartItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+    product = CartProductSerializer(read_only=True)
     product_id = serializers.IntegerField(write_only=True)
-    subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    subtotal = serializers.DecimalField(source='line_subtotal', max_digits=10, decimal_places=2, read_only=True)
     
     class Meta:
         model = CartItem
@@ -75,8 +203,8 @@ class CartItemSerializer(serializers.ModelSerializer):
         return attrs
         
 
-class CartSerializer(serializers.ModelSerializer):
-    items = CartItemSerializer(many=True, read_only=True)
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    items = CartItemSerializer(source='snapshot_items', many=True, read_only=True)
     total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     
     class Meta:
@@ -84,6 +212,42 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'items', 'total_price', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    def to_representation(self, instance):
+        fields = self.selected_fields
+        rows = []
+        if fields is None or 'items' in fields or 'total_price' in fields:
+            if 'snapshot_items' in instance.__dict__:
+                # Already loaded, e.g. by the async cart view
+                rows = [instance_row(item, CART_ITEM_COLUMNS) for item in instance.snapshot_items]
+            else:
+                rows = list(instance.items.with_totals().values(*CART_ITEM_COLUMNS))
+        data = cart_representation(instance, rows, self.context.get('request'))
+        return data if fields is None else {name: data[name] for name in fields}
+
+
+class CartOperationSerializer(serializers.Serializer):
+    OPERATIONS = ['add', 'set', 'remove']
+
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    product_id = serializers.IntegerField(required=False)
+    item_id = serializers.IntegerField(required=False)
+    quantity = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, attrs):
+        if 'product_id' not in attrs and 'item_id' not in attrs:
+            raise serializers.ValidationError("Either product_id or item_id is required.")
+        if attrs['op'] == 'add':
+            attrs.setdefault('quantity', 1)
+            if attrs['quantity'] < 1:
+                raise serializers.ValidationError({"quantity": "Ensure this value is greater than or equal to 1."})
+        if attrs['op'] == 'set' and 'quantity' not in attrs:
+            raise serializers.ValidationError({"quantity": "This field is required."})
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False)
+
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
@@ -95,7 +259,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     user_email = serializers.CharField(source='user.email', read_only=True)
     
@@ -107,6 +271,37 @@ class OrderSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'user', 'created_at', 'updated_at']
 
 
+class OrderListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """ Slim order row for list views; expects Order.objects.for_list() """
+    user_email = serializers.CharField(read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'user', 'user_email', 'status', 'payment_status',
+                  'total_amount', 'item_count', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+
+class ArchivedOrderItemSerializer(OrderItemSerializer):
+    class Meta(OrderItemSerializer.Meta):
+        model = ArchivedOrderItem
+
+
+class ArchivedOrderSerializer(OrderSerializer):
+    """ Same representation as OrderSerializer; archived orders are read-only """
+    items = ArchivedOrderItemSerializer(many=True, read_only=True)
+
+    class Meta(OrderSerializer.Meta):
+        model = ArchivedOrder
+        read_only_fields = OrderSerializer.Meta.fields
+
+
+class ArchivedOrderListSerializer(OrderListSerializer):
+    class Meta(OrderListSerializer.Meta):
+        model = ArchivedOrder
+
+
 class CreateOrderSerializer(serializers.Serializer):
     shipping_address = serializers.CharField(max_length=500)
     shipping_city = serializers.CharField(max_length=100)
@@ -0,0 +1,93 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .archive import is_archiving
+from .authentication import user_cache
+from .counters import adjust_product_count
+from .images import is_current, schedule_variants
+from .models import Category, Order, Product
+from .rollups import ORDER_STATE_FIELDS, OrderState, order_state, queue_order_changes
+from .search import get_search_backend
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_state(sender, instance, **kwargs):
+    # Previous (is_active, category) so post_save can move the category counters
+    instance._previous_state = None
+    if instance.pk:
+        instance._previous_state = (
+            Product.objects.filter(pk=instance.pk).values_list('is_active', 'category_id').first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def update_category_counts(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_previous_state', None)
+    was_active, old_category_id = previous or (False, None)
+    if was_active and instance.is_active and old_category_id == instance.category_id:
+        return
+    if was_active:
+        adjust_product_count(old_category_id, -1)
+    if instance.is_active:
+        adjust_product_count(instance.category_id, 1)
+
+
+@receiver(post_delete, sender=Product)
+def release_category_count(sender, instance, **kwargs):
+    if instance.is_active:
+        adjust_product_count(instance.category_id, -1)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_search_backend().index_product(instance)
+
+
+@receiver(post_save, sender=Product)
+def refresh_image_variants(sender, instance, **kwargs):
+    if instance.image and not is_current(instance):
+        schedule_variants(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created, **kwargs):
+    if not created:
+        get_search_backend().index_category(instance)
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_state(sender, instance, **kwargs):
+    instance._previous_state = None
+    if instance.pk:
+        previous = Order.objects.filter(pk=instance.pk).values_list(*ORDER_STATE_FIELDS).first()
+        instance._previous_state = OrderState(*previous) if previous else None
+
+
+@receiver(post_save, sender=Order)
+def update_sales_rollups(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_previous_state', None)
+    current = order_state(instance)
+    if previous == current:
+        # e.g. a shipping address edit; nothing for the rollups to apply
+        return
+    queue_order_changes([(previous, current)])
+
+
+@receiver(post_delete, sender=Order)
+def remove_from_sales_rollups(sender, instance, **kwargs):
+    if is_archiving():
+        return
+    queue_order_changes([(order_state(instance), None)])
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Password, staff and active changes also change the token version;
+    # dropping the entry makes this process notice immediately
+    user_cache.invalidate(instance.pk)
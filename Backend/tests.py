@@ -1,3 +1,1215 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, modify_settings, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+from rest_framework.exceptions import AuthenticationFailed, ErrorDetail
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ModelSerializer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import benchmark
+from .idempotency import purge_expired_keys
+from .images import generate_variants, refresh_variants
+from .jobs import claim_jobs, enqueue, job_timeout, requeue_stale_jobs, run_job, task
+from .metrics import BUCKETS, QUERIES, REQUESTS, RESPONSE_BYTES, MetricsRegistry, registry
+from .middleware import CompressionMiddleware, MetricsMiddleware, PrimaryPinMiddleware, brotli, choose_encoding
+from .inventory import InsufficientStock, decrement_stock, release_expired_reservations
+from .models import *
+from .archive import archive_orders
+from .counters import rebuild_product_counts
+from .authentication import CachedJWTAuthentication, user_cache
+from .renderers import FastJSONRenderer
+from .rollups import rebuild_rollups
+from .serializers import CartSerializer, CategorySerializer, ProductSerializer
+from .routers import ReplicaRouter, is_pinned, pin_to_primary, read_from_replicas
+from .search import get_search_backend
+from .throttling import take_token
+from .transfer import export_orders, import_products, read_rows
+
+
+SHIPPING = {
+    'shipping_address': '1 Main St',
+    'shipping_city': 'Springfield',
+    'shipping_zip': '12345',
+    'shipping_country': 'US',
+}
+
+
+def make_product(category, stock, name='Widget', price='10.00'):
+    return Product.objects.create(name=name, description='', price=Decimal(price),
+                                  category=category, image='products/widget.jpg', stock=stock)
+
+
+def make_pending_order(user, product, quantity=1):
+    order = Order.objects.create(user=user, total_amount=product.price * quantity, **SHIPPING)
+    OrderItem.objects.create(order=order, product=product, quantity=quantity, price=product.price)
+    return order
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Tools', description='')
+        self.hammer = make_product(category, stock=5, name='Hammer')
+        self.saw = make_product(category, stock=3, name='Saw')
+        self.drill = make_product(category, stock=2, name='Drill')
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, *operations):
+        return self.client.post('/api/cart/batch/', {'operations': list(operations)}, format='json')
+
+    def lines(self):
+        return dict(CartItem.objects.filter(cart__user=self.user).values_list('product__name', 'quantity'))
+
+    def test_operations_on_one_line_combine(self):
+        response = self.batch(
+            {'op': 'add', 'product_id': self.hammer.id, 'quantity': 2},
+            {'op': 'add', 'product_id': self.saw.id},
+            {'op': 'set', 'product_id': self.hammer.id, 'quantity': 4},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.lines(), {'Hammer': 4, 'Saw': 1})
+        self.assertEqual(response.json()['total_price'], '50.00')
+
+        saw_item = CartItem.objects.get(product=self.saw)
+        response = self.batch(
+            {'op': 'add', 'product_id': self.hammer.id},
+            {'op': 'remove', 'item_id': saw_item.id},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.lines(), {'Hammer': 5})
+
+    def test_stock_is_checked_against_the_batch_total(self):
+        self.batch({'op': 'add', 'product_id': self.hammer.id})
+        response = self.batch(
+            {'op': 'add', 'product_id': self.saw.id},
+            {'op': 'add', 'product_id': self.hammer.id, 'quantity': 3},
+            {'op': 'add', 'product_id': self.hammer.id, 'quantity': 2},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Only 5 items available for Hammer'})
+        # Nothing applied
+        self.assertEqual(self.lines(), {'Hammer': 1})
+
+    def test_missing_items_and_inactive_products_are_404(self):
+        self.batch({'op': 'add', 'product_id': self.hammer.id})
+        for operation in ({'op': 'remove', 'product_id': self.drill.id}, {'op': 'remove', 'item_id': 999999},
+                          {'op': 'set', 'item_id': 999999, 'quantity': 1}):
+            response = self.batch({'op': 'add', 'product_id': self.saw.id}, operation)
+            self.assertEqual(response.status_code, 404, operation)
+
+        self.drill.is_active = False
+        self.drill.save()
+        response = self.batch({'op': 'add', 'product_id': self.saw.id}, {'op': 'add', 'product_id': self.drill.id})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'error': 'Product not found'})
+        self.assertEqual(self.lines(), {'Hammer': 1})
+
+    def test_products_are_checked_with_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.batch(*[{'op': 'add', 'product_id': product.id}
+                                    for product in (self.hammer, self.saw, self.drill)])
+        self.assertEqual(response.status_code, 200)
+        product_reads = [q for q in queries if q['sql'].startswith('SELECT') and 'FROM "Backend_product"' in q['sql']]
+        self.assertEqual(len(product_reads), 1)
+
+
+class CategoryCounterTests(TestCase):
+    def setUp(self):
+        self.tools = Category.objects.create(name='Tools', description='')
+        self.garden = Category.objects.create(name='Garden', description='')
+
+    def counts(self):
+        return dict(Category.objects.values_list('name', 'active_product_count'))
+
+    def test_counters_follow_product_changes(self):
+        hammer = make_product(self.tools, stock=1, name='Hammer')
+        make_product(self.tools, stock=1, name='Saw')
+        Product.objects.create(name='Old', description='', price=1, category=self.tools, is_active=False)
+        self.assertEqual(self.counts(), {'Tools': 2, 'Garden': 0})
+
+        hammer.is_active = False
+        hammer.save()
+        self.assertEqual(self.counts(), {'Tools': 1, 'Garden': 0})
+        # Moving an inactive product changes nothing
+        hammer.category = self.garden
+        hammer.save()
+        self.assertEqual(self.counts(), {'Tools': 1, 'Garden': 0})
+        hammer.is_active = True
+        hammer.save()
+        self.assertEqual(self.counts(), {'Tools': 1, 'Garden': 1})
+
+        hammer.category = self.tools
+        hammer.save()
+        self.assertEqual(self.counts(), {'Tools': 2, 'Garden': 0})
+        # A save that changes neither keeps the counts
+        hammer.price = Decimal('12.00')
+        hammer.save()
+        self.assertEqual(self.counts(), {'Tools': 2, 'Garden': 0})
+
+        hammer.delete()
+        Product.objects.get(name='Old').delete()
+        self.assertEqual(self.counts(), {'Tools': 1, 'Garden': 0})
+
+    def test_rebuild_recounts_from_the_products(self):
+        make_product(self.tools, stock=1, name='Hammer')
+        make_product(self.garden, stock=1, name='Hose')
+        Product.objects.create(name='Old', description='', price=1, category=self.garden, is_active=False)
+        Category.objects.update(active_product_count=7)
+
+        self.assertEqual(rebuild_product_counts([self.tools.id]), 1)
+        self.assertEqual(self.counts(), {'Tools': 1, 'Garden': 7})
+        call_command('rebuild_category_counts', stdout=io.StringIO())
+        self.assertEqual(self.counts(), {'Tools': 1, 'Garden': 1})
+
+
+class InventoryTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Tools', description='')
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_decrement_stock_is_all_or_nothing(self):
+        plenty = make_product(self.category, stock=10, name='Plenty')
+        scarce = make_product(self.category, stock=1, name='Scarce')
+
+        with self.assertRaises(InsufficientStock) as ctx:
+            decrement_stock({plenty.id: 3, scarce.id: 2})
+
+        self.assertEqual([p.id for p in ctx.exception.products], [scarce.id])
+        plenty.refresh_from_db()
+        scarce.refresh_from_db()
+        self.assertEqual((plenty.stock, scarce.stock), (10, 1))
+
+    def test_checkout_reserves_stock_and_payment_commits_it(self):
+        product = make_product(self.category, stock=5)
+        self.client.post('/api/cart/add_item/', {'product_id': product.id, 'quantity': 2}, format='json')
+
+        response = self.client.post('/api/orders/', SHIPPING, format='json')
+        self.assertEqual(response.status_code, 201)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 3)
+
+        order_id = response.json()['id']
+        response = self.client.post(f'/api/orders/{order_id}/confirm_payment/')
+        self.assertEqual(response.status_code, 200)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 3)
+        self.assertEqual(StockReservation.objects.get().status, 'committed')
+
+    def test_sweeper_releases_expired_reservations(self):
+        product = make_product(self.category, stock=5)
+        self.client.post('/api/cart/add_item/', {'product_id': product.id, 'quantity': 2}, format='json')
+        order_id = self.client.post('/api/orders/', SHIPPING, format='json').json()['id']
+
+        self.assertEqual(release_expired_reservations(), 0)
+        released = release_expired_reservations(now=timezone.now() + timedelta(days=1))
+
+        self.assertEqual(released, 1)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 5)
+        order = Order.objects.get(pk=order_id)
+        self.assertEqual((order.status, order.payment_status), ('cancelled', 'failed'))
+        response = self.client.post(f'/api/orders/{order_id}/confirm_payment/')
+        self.assertEqual(response.status_code, 404)
+
+
+    def test_alert_is_written_when_stock_crosses_the_threshold(self):
+        product = make_product(self.category, stock=12)
+
+        decrement_stock({product.id: 1})
+        self.assertFalse(StockAlert.objects.exists())
+        decrement_stock({product.id: 1})
+        alert = StockAlert.objects.get()
+        self.assertEqual((alert.product_id, alert.stock, alert.threshold), (product.id, 10, 10))
+        # Already below: later sales don't repeat the alert
+        decrement_stock({product.id: 3})
+        self.assertEqual(StockAlert.objects.count(), 1)
+
+    def test_low_stock_lists_products_at_their_own_threshold(self):
+        at = make_product(self.category, stock=10, name='At')
+        make_product(self.category, stock=11, name='Above')
+        Product.objects.create(name='Custom', description='', price=5, category=self.category,
+                               stock=3, low_stock_threshold=2)
+        Product.objects.create(name='Retired', description='', price=5, category=self.category,
+                               stock=0, is_active=False)
+
+        self.assertEqual(self.client.get('/api/products/low_stock/').status_code, 403)
+        admin = APIClient()
+        admin.force_authenticate(User.objects.create_user('admin', 'admin@example.com', 'pw', is_staff=True))
+        response = admin.get('/api/products/low_stock/')
+        self.assertEqual([p['id'] for p in response.json()], [at.id])
+
+    def test_stock_alerts_are_read_incrementally_by_admins(self):
+        product = make_product(self.category, stock=5)
+        ids = [StockAlert.objects.create(product=product, stock=n, threshold=10).id for n in (3, 2, 1)]
+        self.assertEqual(self.client.get('/api/products/stock_alerts/').status_code, 403)
+
+        admin = APIClient()
+        admin.force_authenticate(User.objects.create_user('admin', 'admin@example.com', 'pw', is_staff=True))
+        first = admin.get('/api/products/stock_alerts/?limit=2').json()
+        self.assertEqual(([a['id'] for a in first['results']], first['last_id']), (ids[:2], ids[1]))
+        rest = admin.get(f"/api/products/stock_alerts/?after={first['last_id']}").json()
+        self.assertEqual(([a['id'] for a in rest['results']], rest['last_id']), (ids[2:], ids[2]))
+        done = admin.get(f"/api/products/stock_alerts/?after={rest['last_id']}").json()
+        self.assertEqual((done['results'], done['last_id']), ([], ids[2]))
+
+        self.assertEqual([a['id'] for a in admin.get('/api/products/stock_alerts/?limit=-1').json()['results']],
+                         ids[:1])
+        self.assertEqual(admin.get('/api/products/stock_alerts/?after=latest').status_code, 400)
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Tools', description='')
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_retries_replay_the_stored_response(self):
+        product = make_product(self.category, stock=5)
+        self.client.post('/api/cart/add_item/', {'product_id': product.id, 'quantity': 2}, format='json')
+
+        first = self.client.post('/api/orders/', SHIPPING, format='json', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(first.status_code, 201)
+        # One lookup of the key; no cart, order or stock query
+        with self.assertNumQueries(1):
+            retry = self.client.post('/api/orders/', SHIPPING, format='json', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+        other = self.client.post('/api/orders/', {**SHIPPING, 'shipping_city': 'Shelbyville'},
+                                 format='json', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(other.status_code, 422)
+
+        order_id = first.json()['id']
+        paid = self.client.post(f'/api/orders/{order_id}/confirm_payment/', HTTP_IDEMPOTENCY_KEY='pay-1')
+        again = self.client.post(f'/api/orders/{order_id}/confirm_payment/', HTTP_IDEMPOTENCY_KEY='pay-1')
+        self.assertEqual((paid.status_code, again.status_code), (200, 200))
+        self.assertEqual(again.json(), paid.json())
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 3)
+
+        self.assertEqual(purge_expired_keys(), 0)
+        self.assertEqual(purge_expired_keys(now=timezone.now() + timedelta(days=2)), 2)
+
+    def test_losing_the_race_to_an_expired_key_asks_for_a_retry(self):
+        IdempotencyKey.objects.create(user=self.user, key='k', fingerprint='', status_code=201,
+                                      expires_at=timezone.now() - timedelta(minutes=1))
+        # Another request holds the key, but its row has expired by the time we look
+        with mock.patch.object(IdempotencyKey.objects, 'create', side_effect=IntegrityError):
+            response = self.client.post('/api/orders/', SHIPPING, format='json', HTTP_IDEMPOTENCY_KEY='k')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.exists())
+
+    def test_failed_requests_do_not_keep_the_key(self):
+        # An exception (here a missing cart) rolls the key back with everything else
+        response = self.client.post('/api/orders/', SHIPPING, format='json', HTTP_IDEMPOTENCY_KEY='k')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class CatalogPaginationTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Tools', description='')
+        for n in range(7):
+            make_product(category, stock=1, name=f'Widget {n}')
+        # One import batch: every row shares a created_at, only id breaks the tie
+        Product.objects.update(created_at=timezone.now())
+
+    def test_pages_cover_every_product_once(self):
+        seen = []
+        url = '/api/products/?page_size=3'
+        while url:
+            body = self.client.get(url).json()
+            self.assertLessEqual(len(body['results']), 3)
+            seen += [p['id'] for p in body['results']]
+            url = body['next']
+        self.assertEqual(seen, sorted(Product.objects.values_list('id', flat=True)))
+
+    def test_list_is_unpaginated_without_cursor_or_page_size(self):
+        body = self.client.get('/api/products/').json()
+        self.assertIsInstance(body, list)
+        self.assertEqual(len(body), 7)
+
+class FacetTests(TestCase):
+    def setUp(self):
+        tools = Category.objects.create(name='Tools', description='')
+        toys = Category.objects.create(name='Toys', description='')
+        make_product(tools, stock=3, name='Hammer', price='10.00')
+        make_product(tools, stock=1, name='Drill', price='60.00')
+        make_product(toys, stock=0, name='Kite', price='30.00')
+        make_product(toys, stock=2, name='Robot', price='300.00')
+        self.tools, self.toys = tools, toys
+
+    def test_filters_and_facets_come_from_one_grouped_query(self):
+        client = APIClient()
+        # ETag aggregate, results, facets
+        with self.assertNumQueries(3):
+            response = client.get('/api/products/?facets=1&min_price=20&in_stock=1')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(sorted(p['name'] for p in body['results']), ['Drill', 'Robot'])
+        facets = body['facets']
+        self.assertEqual((facets['count'], facets['in_stock']), (2, 2))
+        self.assertEqual([band['count'] for band in facets['price_ranges']], [0, 0, 1, 0, 1])
+        self.assertEqual(facets['categories'], [
+            {'id': self.tools.id, 'name': 'Tools', 'count': 1},
+            {'id': self.toys.id, 'name': 'Toys', 'count': 1},
+        ])
+
+        async_body = client.get('/api/async/products/?facets=1&min_price=20&in_stock=1').json()
+        self.assertEqual(async_body['facets'], facets)
+
+        names = [p['name'] for p in client.get('/api/products/?max_price=30&page_size=10').json()['results']]
+        self.assertEqual(sorted(names), ['Hammer', 'Kite'])
+        self.assertEqual(client.get('/api/products/?min_price=cheap').status_code, 400)
+        self.assertEqual(client.get('/api/async/products/?min_price=cheap').status_code, 400)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        get_search_backend().reset()
+        self.tools = Category.objects.create(name='Tools', description='')
+        self.garden = Category.objects.create(name='Garden', description='')
+
+    def search(self, term, path='/api/products/', **params):
+        response = self.client.get(path, {'search': term, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def names(self, term):
+        return [product['name'] for product in self.search(term)['results']]
+
+    def test_ranking(self):
+        Product.objects.create(name='Bucket', description='Carries water to the hose', price=5, category=self.garden)
+        Product.objects.create(name='Garden hose', description='Green', price=5, category=self.garden)
+        Product.objects.create(name='Hammer', description='', price=5, category=self.tools)
+
+        # Name beats category beats description
+        self.assertEqual(self.names('hose'), ['Garden hose', 'Bucket'])
+        self.assertEqual(self.names('garden hoses'), ['Garden hose', 'Bucket'])
+        self.assertEqual(self.names('tools'), ['Hammer'])
+        # Every term has to match
+        self.assertEqual(self.names('hose hammer'), [])
+
+    def test_results_are_paginated(self):
+        for n in range(40):
+            make_product(self.tools, stock=1, name=f'Widget {n}')
+
+        first = self.search('widget', page_size=5)
+        self.assertEqual(first['count'], 40)
+        self.assertEqual(len(first['results']), 5)
+        second = self.search('widget', page_size=5, offset=5)
+        self.assertFalse({p['id'] for p in first['results']} & {p['id'] for p in second['results']})
+        self.assertEqual(len(self.search('widget')['results']), 24)
+        self.assertEqual(self.search('widget', path='/api/async/products/', page_size=5)['results'], first['results'])
+
+    def test_next_links_stop_at_max_offset(self):
+        Product.objects.bulk_create(
+            Product(name=f'Widget {n}', description='', price=5, category=self.tools)
+            for n in range(1100)
+        )
+        get_search_backend().reset()
+
+        seen = []
+        url = '/api/products/?search=widget&page_size=100'
+        while url:
+            body = self.client.get(url).json()
+            seen += [p['id'] for p in body['results']]
+            url = body['next']
+            self.assertLessEqual(len(seen), 1100)
+        # Offsets 0..1000 are reachable, each row once
+        self.assertEqual(len(seen), 1100)
+        self.assertEqual(len(set(seen)), 1100)
+        past_the_end = self.search('widget', page_size=100, offset=1024)
+        self.assertIsNone(past_the_end['next'])
+
+    @skipUnless(connection.vendor != 'postgresql', 'tests the in-process index')
+    def test_fallback_index_follows_product_changes(self):
+        backend = get_search_backend()
+        hammer = Product.objects.create(name='Hammer', description='', price=5, category=self.tools)
+
+        def found(term):
+            # Inactive rows included, so only the index decides
+            return list(backend.search(Product.objects.all(), term).values_list('name', flat=True))
+
+        self.assertEqual(found('hammer'), ['Hammer'])
+        hammer.name = 'Mallet'
+        hammer.save()
+        self.assertEqual((found('hammer'), found('mallet')), ([], ['Mallet']))
+        self.tools.refresh_from_db()
+        self.tools.name = 'Workshop'
+        self.tools.save()
+        self.assertEqual(found('workshop'), ['Mallet'])
+
+        hammer.is_active = False
+        hammer.save()
+        self.assertEqual(found('mallet'), [])
+        hammer.is_active = True
+        hammer.save()
+        self.assertEqual(found('mallet'), ['Mallet'])
+        hammer.delete()
+        Product.objects.create(name='Mallet', description='', price=5, category=self.garden, is_active=False)
+        self.assertEqual(found('mallet'), [])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Tools', description='')
+        self.product = make_product(self.category, stock=5)
+        make_product(self.category, stock=5, name='Gadget')
+
+    def test_detail_revalidates_until_its_rows_change(self):
+        path = f'/api/products/{self.product.id}/'
+        first = self.client.get(path)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(path, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+        # Guarded stock updates move updated_at too
+        decrement_stock({self.product.id: 1})
+        sold = self.client.get(path, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(sold.status_code, 200)
+        self.assertEqual(sold.json()['stock'], 4)
+
+        # category_name comes from the category row
+        self.category.name = 'Hand tools'
+        self.category.save()
+        renamed = self.client.get(path, HTTP_IF_NONE_MATCH=sold['ETag'])
+        self.assertEqual(renamed.status_code, 200)
+        self.assertEqual(renamed.json()['category_name'], 'Hand tools')
+
+    def test_list_etag_follows_removals(self):
+        first = self.client.get('/api/products/')
+        self.assertFalse(first.has_header('Last-Modified'))
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        # Leaves the newest updated_at where it was
+        self.product.delete()
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['name'] for p in response.json()], ['Gadget'])
+        since = self.client.get('/api/products/', HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(since.status_code, 200)
+
+    def test_category_version_moves_with_its_product_count(self):
+        first = self.client.get('/api/categories/')
+        make_product(self.category, stock=1, name='Third')
+        response = self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['product_count'], 3)
+        self.assertEqual(self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Tools', description='')
+
+    def import_csv(self, text, batch_size=2):
+        return import_products(read_rows(io.BytesIO(text.encode()), 'csv'), batch_size=batch_size)
+
+    def test_import_creates_updates_and_reports_bad_rows(self):
+        Product.objects.create(sku='OLD', name='Old', description='', price=1, stock=9,
+                               category=self.category, image='products/old.jpg')
+
+        result = self.import_csv(
+            "sku,name,price,category,stock\n"
+            "NEW1,Hammer,9.50,Tools,4\n"
+            "OLD,Renamed,2.00,Tools,\n"
+            "BAD,Saw,1.00,Nowhere,1\n"
+            "NEW2,Drill,30,Tools,2\n"
+        )
+
+        self.assertEqual((result['created'], result['updated'], result['failed']), (2, 1, 1))
+        self.assertEqual(result['errors'][0]['line'], 4)
+        old = Product.objects.get(sku='OLD')
+        self.assertEqual((old.name, old.stock), ('Renamed', 9))
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.active_product_count, 3)
+
+    def test_export_pairs_orders_with_their_items(self):
+        user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        product = make_product(self.category, stock=5)
+        first = make_pending_order(user, product, quantity=2)
+        Order.objects.create(user=user, total_amount=0, **SHIPPING)
+
+        lines = [json.loads(line) for line in export_orders('jsonl')]
+
+        self.assertEqual([order['id'] for order in lines], [first.id, first.id + 1])
+        self.assertEqual(lines[0]['items'][0]['quantity'], 2)
+        self.assertEqual(lines[1]['items'], [])
+        self.assertEqual(len(list(export_orders('csv'))), 3)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='variant-media-'), IMAGE_VARIANT_WIDTHS=(100, 400))
+class ImageVariantTests(TestCase):
+    def png(self, width, height, color):
+        buffer = io.BytesIO()
+        Image.new('RGB', (width, height), color).save(buffer, 'PNG')
+        return SimpleUploadedFile('photo.png', buffer.getvalue(), 'image/png')
+
+    def test_variants_are_scheduled_generated_and_exposed(self):
+        category = Category.objects.create(name='Tools', description='')
+        product = Product.objects.create(name='Lamp', description='', price=5, category=category,
+                                         image=self.png(300, 150, 'red'))
+        self.assertEqual(Job.objects.get().task, refresh_variants.task_name)
+
+        names = generate_variants(product)
+
+        # Never upscaled: 400 is capped at the 300px source
+        self.assertEqual(sorted(names), ['100', '300'])
+        self.assertRegex(names['100'], r'^products/variants/[0-9a-f]{16}-100w\.webp$')
+        with default_storage.open(names['100']) as variant:
+            self.assertEqual(Image.open(variant).size, (100, 50))
+        data = APIClient().get(f'/api/products/{product.id}/').json()
+        self.assertTrue(data['image_variants']['100'].endswith(names['100']))
+
+        # A new image makes the recorded variants stale until regenerated
+        product.image = self.png(300, 150, 'blue')
+        product.save()
+        data = APIClient().get(f'/api/products/{product.id}/').json()
+        self.assertEqual(data['image_variants'], {})
+
+
+@task
+def flaky(fail):
+    if fail:
+        raise RuntimeError('boom')
+
+
+@task
+def outlive_claim(name):
+    # Runs past the timeout: meanwhile the job is requeued and claimed again
+    later = timezone.now() + job_timeout() * 2
+    requeue_stale_jobs(now=later)
+    claim_jobs('second', 1, now=later)
+    Category.objects.create(name=name, description='')
+
+
+class JobQueueTests(TestCase):
+    def test_order_changes_reach_rollups_through_a_job(self):
+        user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        order = Order.objects.create(user=user, total_amount=25, payment_status='completed', **SHIPPING)
+        self.assertFalse(DailySalesRollup.objects.exists())
+
+        for job_id in claim_jobs('test', 10):
+            self.assertTrue(run_job(job_id))
+
+        rollup = DailySalesRollup.objects.get()
+        self.assertEqual((rollup.order_count, rollup.revenue), (1, 25))
+        self.assertEqual(claim_jobs('test', 10), [])
+
+        # Saves that leave the rolled-up fields alone queue nothing
+        order.refresh_from_db()
+        order.shipping_city = 'Shelbyville'
+        order.save()
+        self.assertEqual(Job.objects.filter(status='queued').count(), 0)
+        order.status = 'processing'
+        order.save()
+        self.assertEqual(Job.objects.filter(status='queued').count(), 1)
+
+    def test_failures_back_off_then_give_up(self):
+        job = enqueue(flaky, max_attempts=2, fail=True)
+
+        [job_id] = claim_jobs('test', 10)
+        self.assertFalse(run_job(job_id))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('boom', job.last_error)
+        self.assertEqual(claim_jobs('test', 10), [])
+
+        [job_id] = claim_jobs('test', 10, now=job.run_at)
+        self.assertFalse(run_job(job_id))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_a_run_that_lost_its_claim_rolls_back(self):
+        job = enqueue(outlive_claim, name='Tools')
+
+        [job_id] = claim_jobs('first', 10)
+        self.assertFalse(run_job(job_id))
+        self.assertFalse(Category.objects.exists())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+
+        # On one test connection the takeover rolled back too; redo it for
+        # real, and the worker holding the claim applies the writes once
+        later = timezone.now() + job_timeout() * 2
+        requeue_stale_jobs(now=later)
+        self.assertEqual(claim_jobs('second', 10, now=later), [job_id])
+        self.assertTrue(run_job(job_id))
+        self.assertEqual(Category.objects.count(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class AuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw', is_staff=True)
+
+    def login(self):
+        response = APIClient().post('/api/auth/login/', {'username': 'buyer', 'password': 'pw'}, format='json')
+        return response.json()['access']
+
+    def authenticate(self, token, authentication=CachedJWTAuthentication):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return authentication().authenticate(request)[0]
+
+    def client_for(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client
+
+    def test_cached_user_costs_no_query(self):
+        token = self.login()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate(token), self.user)
+        with self.assertNumQueries(0):
+            user = self.authenticate(token)
+        self.assertEqual((user.pk, user.is_staff), (self.user.pk, True))
+
+    def test_password_change_revokes_tokens(self):
+        token = self.login()
+        client = self.client_for(token)
+        self.assertEqual(client.get('/api/cart/').status_code, 200)
+
+        self.user.set_password('new')
+        self.user.save()
+        response = client.get('/api/cart/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'detail': 'Token is no longer valid for this user'})
+
+    def test_staff_revocation_revokes_tokens(self):
+        client = self.client_for(self.login())
+        self.assertEqual(client.get('/api/orders/analytics/').status_code, 200)
+
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(client.get('/api/orders/analytics/').status_code, 401)
+
+    def test_tokens_without_a_version_behave_like_simplejwt(self):
+        token = str(AccessToken.for_user(self.user))
+        for _ in range(2):
+            # Never cached
+            with self.assertNumQueries(1):
+                self.assertEqual(self.authenticate(token), self.user)
+
+        # Not tied to the password...
+        self.user.set_password('new')
+        self.user.save()
+        self.assertEqual(self.authenticate(token), self.user)
+        # ...but refused for an inactive user, the same way
+        self.user.is_active = False
+        self.user.save()
+        errors = []
+        for authentication in (CachedJWTAuthentication, JWTAuthentication):
+            with self.assertRaises(AuthenticationFailed) as raised:
+                self.authenticate(token, authentication)
+            errors.append(raised.exception.get_codes())
+        self.assertEqual(errors[0], errors[1])
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        self.product = make_product(Category.objects.create(name='Tools', description=''), stock=5)
+        # No image file behind the product, so its variants job would fail
+        Job.objects.all().delete()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_order(self, status, days_old):
+        order = make_pending_order(self.user, self.product)
+        Order.objects.filter(pk=order.pk).update(
+            status=status, created_at=timezone.now() - timedelta(days=days_old)
+        )
+        return order
+
+    def drain_jobs(self):
+        for job_id in claim_jobs('test', 100):
+            self.assertTrue(run_job(job_id))
+
+    def test_finished_old_orders_move_to_the_archive_and_stay_readable(self):
+        old = self.make_order('delivered', days_old=400)
+        old_cancelled = self.make_order('cancelled', days_old=500)
+        recent = self.make_order('delivered', days_old=10)
+        open_order = self.make_order('processing', days_old=400)
+        self.drain_jobs()
+        # The backdating above bypassed the rollup signals
+        rebuild_rollups()
+        before = self.client.get(f'/api/orders/{old.id}/').json()
+        rollups = list(DailySalesRollup.objects.values_list('date', 'order_count', 'revenue'))
+
+        self.assertEqual(archive_orders(batch_size=1), 2)
+
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)), {recent.id, open_order.id})
+        self.assertFalse(OrderItem.objects.filter(order_id=old.id).exists())
+        self.assertEqual(self.client.get(f'/api/orders/{old.id}/').json(), before)
+        archived = self.client.get('/api/orders/?archived=1').json()['results']
+        self.assertEqual([o['id'] for o in archived], [old.id, old_cancelled.id])
+        self.assertEqual(archived[0]['item_count'], 1)
+        self.assertEqual(self.client.post(f'/api/orders/{old.id}/confirm_payment/').status_code, 404)
+
+        # Archiving is not a deletion as far as sales figures go
+        self.drain_jobs()
+        self.assertEqual(list(DailySalesRollup.objects.values_list('date', 'order_count', 'revenue')), rollups)
+        rebuild_rollups()
+        self.assertEqual(list(DailySalesRollup.objects.values_list('date', 'order_count', 'revenue')), rollups)
+
+    def test_payments_move_with_their_orders(self):
+        old = self.make_order('delivered', days_old=400)
+        payment = Payment.objects.create(order=old, transaction_id='TXN-1', payment_method='upi',
+                                         amount=old.total_amount, status='completed')
+
+        self.assertEqual(archive_orders(), 1)
+
+        connection.check_constraints()
+        self.assertFalse(Payment.objects.exists())
+        archived = ArchivedPayment.objects.get()
+        self.assertEqual((archived.id, archived.order_id, archived.transaction_id, archived.created_at),
+                         (payment.id, old.id, 'TXN-1', payment.created_at))
+        self.assertEqual(archive_orders(), 0)
+
+
+@override_settings(API_THROTTLE_RATES={'cart_add': {'user': '2/min'}, 'login': {'ip': '1/min'},
+                                       'search': {'ip': '2/min'}})
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_bucket_refills_at_its_rate(self):
+        now = time.time()
+        self.assertEqual([take_token('bucket', 3, 60, now=now) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(take_token('bucket', 3, 60, now=now), 20, places=2)
+        self.assertEqual(take_token('bucket', 3, 60, now=now + 20), 0)
+        self.assertNotEqual(take_token('bucket', 3, 60, now=now + 20), 0)
+
+    def test_bucket_outlives_its_refill_time(self):
+        # The cache expires keys by the same clock
+        clock = [time.time()]
+        with mock.patch('time.time', lambda: clock[0]):
+            allowed = 0
+            for _ in range(120):
+                allowed += take_token('steady', 10, 60) == 0
+                clock[0] += 1
+        # The burst, then one token every 6 seconds
+        self.assertLessEqual(allowed, 10 + 120 // 6)
+
+    def test_limited_actions_get_429_before_any_query(self):
+        user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        product = make_product(Category.objects.create(name='Tools', description=''), stock=5)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        for _ in range(2):
+            response = client.post('/api/cart/add_item/', {'product_id': product.id}, format='json')
+            self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            response = client.post('/api/cart/add_item/', {'product_id': product.id}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        # Other cart actions have no scope
+        self.assertEqual(client.get('/api/cart/').status_code, 200)
+
+        login = {'username': 'buyer', 'password': 'pw'}
+        self.assertEqual(APIClient().post('/api/auth/login/', login, format='json').status_code, 200)
+        self.assertEqual(APIClient().post('/api/auth/login/', login, format='json').status_code, 429)
+
+    def test_async_search_shares_the_search_limit(self):
+        make_product(Category.objects.create(name='Tools', description=''), stock=5)
+        statuses = [self.client.get(path).status_code for path in (
+            '/api/async/products/?search=widget', '/api/products/?search=widget',
+            '/api/async/products/?search=widget', '/api/products/?search=widget',
+        )]
+        self.assertEqual(statuses, [200, 200, 429, 429])
+        response = self.client.get('/api/async/products/?search=widget')
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(response.json(), self.client.get('/api/products/?search=widget').json())
+        # Browsing isn't limited
+        self.assertEqual(self.client.get('/api/async/products/').status_code, 200)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTests(SimpleTestCase):
+    router = ReplicaRouter()
+
+    def test_only_reads_inside_the_replica_context_leave_the_primary(self):
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+        with read_from_replicas():
+            self.assertEqual(self.router.db_for_read(Product), 'replica')
+            self.assertEqual(self.router.db_for_write(Product), 'default')
+
+    def test_writers_are_pinned_to_the_primary(self):
+        user = User(pk=7, username='writer')
+        self.assertFalse(is_pinned(user))
+        pin_to_primary(user)
+        self.assertTrue(is_pinned(user))
+        self.assertFalse(is_pinned(User(pk=8, username='other')))
+
+
+@skipUnless('replica' in settings.DATABASES, "needs a second database alias named 'replica'")
+@override_settings(DATABASE_REPLICAS=['replica'], DATABASE_ROUTERS=['Backend.routers.ReplicaRouter'])
+@modify_settings(MIDDLEWARE={'append': 'Backend.middleware.PrimaryPinMiddleware'})
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Two separate databases and no replication between them: whatever a
+    request reads from the replica can't include rows written to the primary.
+    """
+    # The test runner rejects unknown aliases even on skipped classes
+    databases = {'default', 'replica'} & set(settings.DATABASES)
+
+    def setUp(self):
+        category = Category.objects.create(name='Tools', description='')
+        self.product = make_product(category, stock=5)
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+
+    def test_catalog_reads_use_the_replica_until_the_user_writes(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/products/').json(), [])
+        self.assertEqual(client.get('/api/categories/').json(), [])
+
+        # Cart reads and writes stay on the primary, and pin the buyer there
+        response = client.post('/api/cart/add_item/', {'product_id': self.product.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['id'] for p in client.get('/api/products/').json()], [self.product.id])
+
+        self.assertEqual(APIClient().get('/api/products/').json(), [])
+
+
+class ConcurrentPaymentTests(TransactionTestCase):
+    """ Parallel confirm_payment calls racing for the last units of one SKU """
+
+    buyers = 12
+    stock = 5
+
+    def test_parallel_confirms_never_oversell(self):
+        category = Category.objects.create(name='Flash sale', description='')
+        product = make_product(category, stock=self.stock)
+        orders = []
+        for i in range(self.buyers):
+            user = User.objects.create_user(f'buyer{i}', f'buyer{i}@example.com', 'pw')
+            orders.append((user, make_pending_order(user, product)))
+
+        barrier = threading.Barrier(self.buyers)
+        results = []
+        lock = threading.Lock()
+
+        def confirm(user, order):
+            client = APIClient(raise_request_exception=False)
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                # SQLite refuses concurrent writers instead of queueing them,
+                # so a 500 there just means "try again"
+                for attempt in range(200):
+                    code = client.post(f'/api/orders/{order.id}/confirm_payment/').status_code
+                    if code != 500:
+                        break
+                    time.sleep(0.01)
+            finally:
+                connection.close()
+            with lock:
+                results.append(code)
+
+        threads = [threading.Thread(target=confirm, args=pair) for pair in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        paid = Order.objects.filter(payment_status='completed').count()
+        self.assertEqual(paid, self.stock)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(results.count(200), self.stock)
+        self.assertEqual(results.count(409), self.buyers - self.stock)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='bench-media-'))
+class FastSerializerTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Tools', description='Hand tools \u2028 and more')
+        make_product(self.category, stock=0, name='Hammer', price='9.5')
+        variants = {'source': 'products/drill.jpg', 'widths': {'160': 'products/variants/abc-160w.webp'}}
+        Product.objects.create(sku='DRILL', name='Drill', description='Cordless', price=Decimal('120.00'),
+                               category=self.category, image='products/drill.jpg', stock=4,
+                               image_variants=variants)
+        Product.objects.create(name='Saw', description='', price=1, category=self.category, image='')
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        self.request = RequestFactory().get('/api/products/')
+
+    def generic(self, serializer, instance):
+        return ModelSerializer.to_representation(serializer, instance)
+
+    def test_compiled_output_matches_drf(self):
+        for request in (None, self.request):
+            context = {'request': request}
+            products = Product.objects.select_related('category')
+            generic = [self.generic(ProductSerializer(context=context), product) for product in products]
+            self.assertEqual(ProductSerializer(products, many=True, context=context).data, generic)
+            self.assertEqual([ProductSerializer(product, context=context).data for product in products], generic)
+
+        categories = Category.objects.all()
+        self.assertEqual(CategorySerializer(categories, many=True).data,
+                         [self.generic(CategorySerializer(), category) for category in categories])
+
+        cart = Cart.objects.create(user=self.user)
+        self.assertEqual(CartSerializer(cart).data, self.generic(CartSerializer(), Cart.objects.get(pk=cart.pk)))
+        for product in Product.objects.all():
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        cart = Cart.objects.get(pk=cart.pk)
+        with self.assertNumQueries(1):
+            fast = CartSerializer(cart, context={'request': self.request}).data
+        self.assertEqual(fast, self.generic(CartSerializer(context={'request': self.request}), cart))
+
+    def test_orjson_renderer_writes_the_same_bytes(self):
+        data = {
+            'text': 'caf\u00e9 \u2028 \u2029', 'price': Decimal('1.50'), 'when': timezone.now(),
+            'day': timezone.now().date(), 'detail': ErrorDetail('Bad'), 'nested': [{'n': 1, 'f': 0.5, 'none': None}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Tools', description='Hand tools')
+        self.product = make_product(self.category, stock=5, name='Hammer')
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), ' '.join(query['sql'] for query in queries)
+
+    def test_fields_narrow_the_response_and_the_query(self):
+        body, sql = self.get('/api/products/?fields=id,name,price')
+        self.assertEqual(body, [{'id': self.product.id, 'name': 'Hammer', 'price': '10.00'}])
+        self.assertNotIn('description', sql)
+        body, sql = self.get('/api/products/?fields=name,category_name&page_size=5')
+        self.assertEqual(body['results'], [{'name': 'Hammer', 'category_name': 'Tools'}])
+        body, sql = self.get(f'/api/products/{self.product.id}/?omit=description,image_variants')
+        self.assertNotIn('description', body)
+        self.assertIn('image', body)
+        self.assertNotIn('description', sql)
+        self.assertEqual(self.client.get('/api/async/products/?fields=id').json(), [{'id': self.product.id}])
+
+        body, sql = self.get('/api/categories/?fields=name')
+        self.assertEqual(body, [{'name': 'Tools'}])
+        self.assertNotIn('description', sql)
+
+        self.client.post('/api/cart/add_item/', {'product_id': self.product.id}, format='json')
+        body, sql = self.get('/api/cart/?fields=id,updated_at')
+        self.assertEqual(set(body), {'id', 'updated_at'})
+        self.assertNotIn('Backend_cartitem', sql)
+        self.assertEqual(self.get('/api/cart/?fields=total_price')[0], {'total_price': '10.00'})
+
+        order = make_pending_order(self.user, self.product)
+        body, sql = self.get('/api/orders/')
+        self.assertEqual(body['results'][0]['item_count'], 1)
+        # Counted per row, so the page's LIMIT doesn't wait for an aggregate over every order
+        self.assertNotIn('GROUP BY "Backend_order"', sql)
+        body, sql = self.get('/api/orders/?fields=id,status')
+        self.assertEqual(body['results'], [{'id': order.id, 'status': 'pending'}])
+        self.assertNotIn('shipping_address', sql)
+        self.assertNotIn('COUNT', sql)
+        body, sql = self.get(f'/api/orders/{order.id}/?omit=items,user_email')
+        self.assertNotIn('items', body)
+        self.assertNotIn('Backend_orderitem', sql)
+        self.assertEqual(self.get(f'/api/orders/{order.id}/')[0]['items'][0]['quantity'], 1)
+
+    def test_unknown_fields_are_rejected(self):
+        for path in ('/api/products/?fields=name,secret', '/api/async/products/?omit=secret',
+                     '/api/categories/?fields=secret', '/api/cart/?fields=secret', '/api/orders/?omit=secret'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 400, path)
+            self.assertEqual(response.json(), {'fields': ['Unknown field "secret".']})
+
+
+@modify_settings(MIDDLEWARE={'append': 'Backend.middleware.CompressionMiddleware'})
+@override_settings(COMPRESS_MIN_BYTES=200)
+class CompressionTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Tools', description='')
+        for n in range(10):
+            make_product(category, stock=n, name=f'Widget {n}')
+
+    def test_encoding_follows_accept_encoding(self):
+        self.assertEqual(choose_encoding('gzip, deflate, br'), 'br' if brotli else 'gzip')
+        self.assertEqual(choose_encoding('br;q=0.5, gzip'), 'gzip')
+        self.assertEqual(choose_encoding('*'), 'br' if brotli else 'gzip')
+        self.assertIsNone(choose_encoding('gzip;q=0, identity'))
+        self.assertIsNone(choose_encoding(''))
+
+    def test_large_responses_are_gzipped(self):
+        plain = self.client.get('/api/products/')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        revalidated = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip',
+                                      HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+        # Below COMPRESS_MIN_BYTES
+        small = self.client.get('/api/categories/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_brotli_when_the_client_accepts_it(self):
+        plain = self.client.get('/api/products/')
+        response = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+
+
+@modify_settings(MIDDLEWARE={'prepend': 'Backend.middleware.MetricsMiddleware'})
+class MetricsTests(TestCase):
+    LABELS = 'route="product-list",method="GET"'
+
+    def setUp(self):
+        registry.reset()
+
+    def test_prometheus_output(self):
+        metrics = MetricsRegistry()
+        metrics.observe('product-list', 'GET', 0.02, 2, 0.25, 100)
+        metrics.observe('product-list', 'GET', 0.3, 3, 0.5, 50)
+        # Slower than the last bucket: only in +Inf
+        metrics.observe('product-list', 'GET', 30, 0, 0, 0)
+        metrics.observe('say "hi"\\', 'POST', 0.001, 0, 0, 0)
+        text = metrics.render()
+
+        self.assertIn('# TYPE http_request_duration_seconds histogram\n', text)
+        for line in (
+            f'http_requests_total{{{self.LABELS}}} 3',
+            f'http_request_duration_seconds_bucket{{{self.LABELS},le="0.01"}} 0',
+            f'http_request_duration_seconds_bucket{{{self.LABELS},le="0.025"}} 1',
+            f'http_request_duration_seconds_bucket{{{self.LABELS},le="0.5"}} 2',
+            f'http_request_duration_seconds_bucket{{{self.LABELS},le="10.0"}} 2',
+            f'http_request_duration_seconds_bucket{{{self.LABELS},le="+Inf"}} 3',
+            f'http_request_duration_seconds_count{{{self.LABELS}}} 3',
+            f'http_request_db_queries_total{{{self.LABELS}}} 5',
+            f'http_request_db_seconds_total{{{self.LABELS}}} 0.750000',
+            f'http_response_bytes_total{{{self.LABELS}}} 150',
+            'http_requests_total{route="say \\"hi\\"\\\\",method="POST"} 1',
+        ):
+            self.assertIn(line + '\n', text)
+
+    def test_workers_merge_through_the_multiprocess_directory(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_MULTIPROC_DIR=directory):
+            other_worker = [0] * (5 + len(BUCKETS))
+            other_worker[:5] = [2, 0.5, 4, 0.5, 300]
+            with open(os.path.join(directory, 'metrics-1.json'), 'w') as fh:
+                json.dump([['product-list', 'GET', other_worker]], fh)
+            # Not a worker file
+            open(os.path.join(directory, 'metrics-2.json.tmp'), 'w').close()
+
+            metrics = MetricsRegistry()
+            metrics.observe('product-list', 'GET', 0.25, 2, 0.25, 100)
+            merged = metrics.collect()
+
+            self.assertEqual(merged[('product-list', 'GET')][:5], [3, 0.75, 6, 0.75, 400])
+            self.assertTrue(os.path.exists(os.path.join(directory, f'metrics-{os.getpid()}.json')))
+
+    def test_requests_are_counted_per_route(self):
+        make_product(Category.objects.create(name='Tools', description=''), stock=1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products/')
+
+        series = registry.snapshot()[('product-list', 'GET')]
+        self.assertEqual(series[REQUESTS], 1)
+        self.assertEqual(series[QUERIES], len(queries))
+        self.assertEqual(series[RESPONSE_BYTES], len(response.content))
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('admin', 'admin@example.com', 'pw', is_staff=True))
+        self.assertIn(f'http_requests_total{{{self.LABELS}}} 1\n', client.get('/api/metrics').content.decode())
+
+    async def test_async_stack_stays_async(self):
+        async def view(request):
+            return HttpResponse()
+
+        for middleware in (MetricsMiddleware, PrimaryPinMiddleware, CompressionMiddleware):
+            self.assertTrue(iscoroutinefunction(middleware(view)), middleware)
+            self.assertFalse(iscoroutinefunction(middleware(lambda request: HttpResponse())), middleware)
+
+        response = await self.async_client.get('/api/async/categories/')
+        self.assertEqual(response.status_code, 200)
+        series = registry.snapshot()[('async_category_list', 'GET')]
+        self.assertEqual((series[REQUESTS], series[QUERIES]), (1, 1))
+
+
+class EndpointBudgetTests(TestCase):
+    """
+    Every route against its query budget, on a seeded catalog.
+
+    Volumes come from BENCH_* environment variables (see Backend.benchmark).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.volumes = benchmark.volumes_from_env()
+        cls.fixtures = benchmark.seed(cls.volumes)
+
+    def test_endpoints_stay_within_query_budget(self):
+        get_search_backend().reset()
+
+        results = benchmark.run(dict(self.fixtures), iterations=5)
+        print(f"\n{benchmark.format_report(results)}")
+
+        for row in results:
+            with self.subTest(endpoint=row['name']):
+                self.assertEqual(row['failures'], [])
+                self.assertLessEqual(row['queries'], row['budget'])
+
+    def test_serializer_throughput(self):
+        results = benchmark.serializer_throughput()
+        print(f"\n{benchmark.format_throughput(results)}")
+
+        # Wall-clock rates: only a report unless asked for on a quiet machine
+        if not os.environ.get('BENCH_CHECK_SPEEDUP'):
+            return
+        # A handful of rows times the query, not the serializer
+        for row in (row for row in results if row['rows'] >= 100):
+            with self.subTest(serializer=row['name']):
+                self.assertGreater(row['after'], row['before'])
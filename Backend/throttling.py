@@ -0,0 +1,106 @@
+"""
+Token-bucket throttles for the endpoints that are expensive to serve:
+product search, adding to the cart, and login (password hashing).
+
+Each scope has a bucket per user and one per client IP. A bucket is a
+single number in the Django cache: the time at which it will be full
+again (the GCRA form of a token bucket). Taking a token is one atomic
+``incr``, so every worker sharing the cache (Redis, Memcached) shares
+the buckets without locks or read-modify-write races.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+# scope -> {'user' and/or 'ip': 'tokens/period'}; a full bucket allows that burst
+DEFAULT_RATES = {
+    'login': {'ip': '10/min'},
+    'search': {'user': '30/min', 'ip': '120/min'},
+    'cart_add': {'user': '60/min', 'ip': '240/min'},
+}
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def throttle_rates():
+    return {**DEFAULT_RATES, **getattr(settings, 'API_THROTTLE_RATES', {})}
+
+
+def parse_rate(rate):
+    """ '30/min' -> (30 tokens, refilled over 60 seconds) """
+    tokens, period = rate.split('/')
+    return int(tokens), PERIODS[period[0]]
+
+
+def take_token(key, tokens, period, now=None):
+    """
+    Take a token from the bucket at ``key``. Returns 0 if there was one,
+    else the seconds until there will be.
+    """
+    now = int((time.time() if now is None else now) * 1000)
+    interval = max(1, period * 1000 // tokens)
+    # A granted take leaves full-at at most one period ahead, so a key kept
+    # two periods past its last grant is never forgotten before it is full
+    lifetime = 2 * period
+    cache.add(key, now, lifetime)
+    try:
+        full_at = cache.incr(key, interval)
+    except ValueError:
+        # Evicted between add and incr
+        full_at = now - 1
+    if full_at - interval <= now:
+        # It was full, so count from now. Requests racing here may each get
+        # a token from the same refill, which lets a few extra through once.
+        cache.set(key, now + interval, lifetime)
+        return 0
+    if full_at - now <= period * 1000:
+        cache.touch(key, lifetime)
+        return 0
+    # No token left: give back the one just taken
+    cache.decr(key, interval)
+    return (full_at - now - period * 1000) / 1000
+
+
+def throttle_wait(scope, user, ident, now=None):
+    """
+    Take a token from each of ``scope``'s buckets for ``user`` and the
+    client IP ``ident``. Returns 0 if the request may go ahead, else the
+    seconds until it may.
+    """
+    rates = throttle_rates().get(scope)
+    if not rates:
+        return 0
+
+    buckets = []
+    if 'user' in rates and user.is_authenticated:
+        buckets.append((f'throttle:{scope}:user:{user.pk}', rates['user']))
+    if 'ip' in rates:
+        buckets.append((f'throttle:{scope}:ip:{ident}', rates['ip']))
+
+    now = time.time() if now is None else now
+    for key, rate in buckets:
+        wait = take_token(key, *parse_rate(rate), now=now)
+        if wait:
+            return wait
+    return 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Limits requests by the view's ``throttle_scope`` (a property on viewsets
+    whose actions differ) at the rates in API_THROTTLE_RATES. Requests
+    without a scope aren't limited. Refusals are 429s with Retry-After.
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if not throttle_rates().get(scope):
+            self.retry_after = None
+            return True
+        self.retry_after = throttle_wait(scope, request.user, self.get_ident(request)) or None
+        return self.retry_after is None
+
+    def wait(self):
+        return math.ceil(self.retry_after) if self.retry_after else None
@@ -0,0 +1,199 @@
+"""
+Bulk catalog import and order export.
+
+Both directions stream: imports validate and write fixed-size batches,
+exports read through server-side cursors, so memory use does not grow
+with the size of the file or of the order table.
+"""
+import csv
+import io
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import as_serializer_error
+
+from .counters import rebuild_product_counts
+from .models import ArchivedOrder, ArchivedOrderItem, Category, Order, OrderItem, Product
+from .search import get_search_backend
+from .serializers import ProductImportSerializer
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+IMPORT_BATCH_SIZE = 1000
+# Rows reported back in full; later failures are only counted
+MAX_REPORTED_ERRORS = 100
+
+EXPORT_CHUNK_SIZE = 2000
+ORDER_COLUMNS = ('id', 'created_at', 'user_id', 'user__email', 'status', 'payment_status',
+                 'total_amount', 'tax_amount', 'shipping_address', 'shipping_city',
+                 'shipping_zip', 'shipping_country')
+ITEM_COLUMNS = ('product_id', 'product__name', 'quantity', 'price')
+# Output names for the columns above
+ORDER_FIELDS = ('id', 'created_at', 'user_id', 'user_email', 'status', 'payment_status',
+                'total_amount', 'tax_amount', 'shipping_address', 'shipping_city',
+                'shipping_zip', 'shipping_country')
+ITEM_FIELDS = ('product_id', 'product_name', 'quantity', 'price')
+CSV_HEADER = ['order_id', *ORDER_FIELDS[1:], *ITEM_FIELDS]
+
+
+def import_format(filename, requested=None):
+    """ ``requested`` if given, else guessed from the file extension """
+    if requested:
+        return requested
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_rows(stream, format):
+    """ Yield ``(line number, row)`` from a binary CSV or JSON-lines stream """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            # Empty cells mean "not given", like a missing JSON key
+            yield reader.line_num, {key: value for key, value in row.items() if key and value}
+    else:
+        for line_number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, None
+
+
+def import_products(rows, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Create or update products from ``(line number, row)`` pairs, matching on SKU.
+
+    Invalid rows are skipped and reported; valid ones are written
+    ``batch_size`` at a time with bulk_create / bulk_update, each batch in
+    its own transaction. Returns a summary dict.
+    """
+    categories = dict(Category.objects.values_list('name', 'id'))
+    # One instance for every row: building the fields is most of the cost of a serializer
+    validator = ProductImportSerializer(context={'categories': categories})
+    result = {'created': 0, 'updated': 0, 'failed': 0, 'errors': []}
+    batch = {}
+
+    for line_number, row in rows:
+        if not isinstance(row, dict):
+            _reject(result, line_number, {'non_field_errors': ['Expected a JSON object.']})
+            continue
+        try:
+            data = validator.run_validation(row)
+        except ValidationError as exc:
+            _reject(result, line_number, as_serializer_error(exc))
+            continue
+        # Later rows for the same SKU override the columns they give
+        batch[data['sku']] = {**batch.get(data['sku'], {}), **data}
+        if len(batch) >= batch_size:
+            _write_batch(batch, result)
+            batch = {}
+
+    if batch:
+        _write_batch(batch, result)
+    return result
+
+
+def _reject(result, line_number, errors):
+    result['failed'] += 1
+    if len(result['errors']) < MAX_REPORTED_ERRORS:
+        result['errors'].append({'line': line_number, 'errors': errors})
+
+
+def _write_batch(batch, result):
+    existing = Product.objects.in_bulk(list(batch), field_name='sku')
+    now = timezone.now()
+    created, updated, fields = [], [], {'updated_at'}
+    category_ids = set()
+
+    for sku, data in batch.items():
+        product = existing.get(sku)
+        if product is None:
+            created.append(Product(**data))
+        else:
+            category_ids.add(product.category_id)
+            for field, value in data.items():
+                setattr(product, field, value)
+            product.updated_at = now
+            fields.update(data)
+            updated.append(product)
+        category_ids.add(data['category_id'])
+
+    with transaction.atomic():
+        Product.objects.bulk_create(created)
+        if updated:
+            Product.objects.bulk_update(updated, sorted(fields))
+        # bulk writes skip the signals that keep these current
+        rebuild_product_counts(category_ids)
+        get_search_backend().index_products([product.pk for product in created + updated])
+
+    result['created'] += len(created)
+    result['updated'] += len(updated)
+
+
+class Echo:
+    """ File-like sink for csv.writer that hands each line back instead of buffering it """
+
+    def write(self, value):
+        return value
+
+
+def export_orders(format='csv', since=None, status=None, archived=False):
+    """
+    Yield orders (or with ``archived``, archived orders) with their items as
+    CSV (one row per item) or JSON lines (one order per line).
+
+    Orders and items are read by two server-side cursors in order id order
+    and merged here, so no more than one chunk of each is held in memory.
+    """
+    order_model, item_model = (ArchivedOrder, ArchivedOrderItem) if archived else (Order, OrderItem)
+    orders = order_model.objects.all()
+    if since:
+        orders = orders.filter(created_at__date__gte=since)
+    if status:
+        orders = orders.filter(status=status)
+    # Fix the upper bound so orders placed mid-export can't half-appear
+    last_id = orders.aggregate(last=Max('id'))['last'] or 0
+    orders = orders.filter(id__lte=last_id).order_by('id')
+    items = (
+        item_model.objects.filter(order__in=orders.values('id'))
+        .order_by('order_id', 'id')
+        .values_list('order_id', *ITEM_COLUMNS)
+    )
+
+    grouped = _merge_items(orders.values_list(*ORDER_COLUMNS).iterator(chunk_size=EXPORT_CHUNK_SIZE),
+                           items.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    if format == 'jsonl':
+        for order, order_items in grouped:
+            yield _order_json(order, order_items) + '\n'
+        return
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for order, order_items in grouped:
+        fields = [order[0], order[1].isoformat(), *order[2:]]
+        for item in order_items or [(None,) * len(ITEM_COLUMNS)]:
+            yield writer.writerow(fields + list(item))
+
+
+def _merge_items(orders, items):
+    """ Pair each order row with its item rows; both streams are sorted by order id """
+    pending = next(items, None)
+    for order in orders:
+        order_items = []
+        while pending is not None and pending[0] <= order[0]:
+            if pending[0] == order[0]:
+                order_items.append(pending[1:])
+            pending = next(items, None)
+        yield order, order_items
+
+
+def _order_json(order, items):
+    data = dict(zip(ORDER_FIELDS, order))
+    data['items'] = [dict(zip(ITEM_FIELDS, item)) for item in items]
+    # DjangoJSONEncoder writes datetimes as ISO 8601 and Decimals as strings
+    return json.dumps(data, cls=DjangoJSONEncoder)
@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
 from .views import *
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet)
@@ -12,9 +13,18 @@ router.register(r'orders', OrderViewSet, basename='order')
 urlpatterns = [
     # Authentication
     path('auth/register/', RegisterView.as_view(), name='register'),
-    path('auth/login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('auth/login/', LoginView.as_view(), name='token_obtain_pair'),
     path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/profile/', UserProfileView.as_view(), name='user_profile'),
+
+    # Monitoring
+    path('metrics', MetricsView.as_view(), name='metrics'),
+
+    # Async read paths (serve with an ASGI server)
+    path('async/products/', async_views.product_list, name='async_product_list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async_product_detail'),
+    path('async/categories/', async_views.category_list, name='async_category_list'),
+    path('async/cart/', async_views.cart_detail, name='async_cart_detail'),
        
 #     Router URLs
     path('', include(router.urls))
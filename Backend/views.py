@@ -3,12 +3,35 @@ from rest_framework import viewsets, status, generics
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework.views import APIView
+from rest_framework.settings import api_settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.contrib.auth.models import User
 from django.db import transaction
+from django.db.models import F, Sum
 from django.conf import settings
+from datetime import date
+from decimal import Decimal
 from .models import *
 from .serializers import *
 from .permissions import *
+from .renderers import FastJSONRenderer
+from .mixins import ConditionalGetMixin, ReplicaReadMixin, SparseRetrieveMixin
+from .authentication import CachedJWTAuthentication, request_cart_id
+from .metrics import registry as metrics_registry
+from .pagination import CatalogCursorPagination, OrderCursorPagination, SearchPagination
+from .search import get_search_backend
+from .facets import facet_counts, filter_products
+from .idempotency import idempotent
+from .inventory import InsufficientStock, commit_reservations, reserve_stock
+from .throttling import TokenBucketThrottle
+from .transfer import IMPORT_FORMATS, export_orders, import_format, import_products, read_rows
+
+TAX_RATE = Decimal('0.10')
+# orjson first for the hot read endpoints, then whatever the project renders with
+FAST_RENDERERS = [FastJSONRenderer, *api_settings.DEFAULT_RENDERER_CLASSES]
+
 
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
@@ -16,37 +39,87 @@ class RegisterView(generics.CreateAPIView):
     serializer_class = RegisterSerializer
 
 
+class LoginView(TokenObtainPairView):
+    serializer_class = LoginSerializer
+    # Each attempt hashes a password
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'login'
+
+
+class MetricsView(APIView):
+    """ Admin endpoint exposing per-route request metrics in Prometheus text format """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(metrics_registry.render(),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class UserProfileView(generics.RetrieveUpdateAPIView):
     serializer_class = UserProfileSerializer
     permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
 
     def get_object(self):
         profile, created = UserProfile.objects.get_or_create(user=self.request.user)
         return profile
     
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ReplicaReadMixin, ConditionalGetMixin, SparseRetrieveMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
+    renderer_classes = FAST_RENDERERS
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
 
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.filter(is_active=True)
+class ProductViewSet(ReplicaReadMixin, ConditionalGetMixin, SparseRetrieveMixin, viewsets.ModelViewSet):
+    queryset = Product.objects.filter(is_active=True).select_related('category')
     serializer_class = ProductSerializer
     permission_classes = [IsAdminOrReadOnly]
+    renderer_classes = FAST_RENDERERS
+    throttle_classes = [TokenBucketThrottle]
+    # category_name comes from the category row
+    conditional_timestamps = ('updated_at', 'category__updated_at')
+
+    @property
+    def throttle_scope(self):
+        # Full-text search is the expensive read; browsing isn't limited
+        if self.action == 'list' and self.request.query_params.get('search'):
+            return 'search'
+        return None
+
+    @property
+    def pagination_class(self):
+        # Search results are returned in relevance order, which a
+        # created_at cursor cannot express
+        if self.request.query_params.get('search'):
+            return SearchPagination
+        return CatalogCursorPagination
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        category = self.request.query_params.get('category', None)
+        queryset = filter_products(queryset, self.request.query_params)
         search = self.request.query_params.get('search', None)
-
-        if category:
-            queryset = queryset.filter(category__id=category)
         if search:
-            queryset = queryset.filter(name__icontains=search)
+            queryset = get_search_backend().search(queryset, search)
 
         return queryset
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200 and request.query_params.get('facets') in ('1', 'true'):
+            facets = facet_counts(self.filter_queryset(self.get_queryset()))
+            if isinstance(response.data, dict):
+                response.data['facets'] = facets
+            else:
+                response.data = {'results': response.data, 'facets': facets}
+        return response
+
+    def paginate_queryset(self, queryset):
+        # Rows for the compiled ProductSerializer, with the columns of the
+        # requested fields; the cursor reads created_at from them like instances
+        columns = dict.fromkeys([*self.get_serializer().row_columns, 'created_at'])
+        return super().paginate_queryset(queryset.values(*columns))
     
     @action(detail=False, permission_classes=[IsAdminUser],  methods=['get'])
     def low_stock(self,request):
@@ -54,18 +127,63 @@ class ProductViewSet(viewsets.ModelViewSet):
         if not request.user.is_staff:
             return Response({'error': "Admin access required"})
         
-        products = Product.objects.filter(stock__lte=10, is_active=True)
+        # Served by the product_low_stock_idx partial index
+        products = Product.objects.filter(
+            stock__lte=F('low_stock_threshold'), is_active=True
+        ).select_related('category')
+        page = self.paginate_queryset(products)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
         serializer = self.get_serializer(products, many=True)
         return Response(serializer.data)
+
+    @action(detail=False, permission_classes=[IsAdminUser], methods=['get'])
+    def stock_alerts(self, request):
+        """ Admin endpoint to read low-stock alerts newer than ?after=<alert id> """
+        try:
+            after = int(request.query_params.get('after', 0))
+            limit = max(1, min(int(request.query_params.get('limit', 100)), 500))
+        except ValueError:
+            return Response({'error': "after and limit must be integers"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        alerts = list(StockAlert.objects.filter(id__gt=after).select_related('product')[:limit])
+        return Response({
+            'last_id': alerts[-1].id if alerts else after,
+            'results': StockAlertSerializer(alerts, many=True).data,
+        })
+
+    @action(detail=False, permission_classes=[IsAdminUser], methods=['post'], url_path='import')
+    def import_products(self, request):
+        """ Admin endpoint to create / update products in bulk from an uploaded CSV or JSONL file """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': "Upload the catalog as 'file'"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        format = import_format(upload.name, request.data.get('file_format'))
+        if format not in IMPORT_FORMATS:
+            return Response({'error': f"file_format must be one of {', '.join(IMPORT_FORMATS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Large uploads are spooled to disk by Django and read back a row at a time
+        result = import_products(read_rows(upload.file, format))
+        return Response(result)
     
 
 class CartViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
+    renderer_classes = FAST_RENDERERS
+    throttle_classes = [TokenBucketThrottle]
+
+    @property
+    def throttle_scope(self):
+        return 'cart_add' if self.action == 'add_item' else None
 
     # Get request - retrieve cart
     def list(self, request):
         cart, created = Cart.objects.get_or_create(user=request.user)
-        serializer = CartSerializer(cart)
+        serializer = CartSerializer(cart, context={'query_params': request.query_params})
         return Response(serializer.data)
 
     # Post request - add item to cart
@@ -96,7 +214,7 @@ class CartViewSet(viewsets.ViewSet):
             cart_item.quantity = quantity
             cart_item.save()
 
-        serializer = CartSerializer(cart)
+        serializer = CartSerializer(cart, context={'query_params': request.query_params})
         return Response(serializer.data)
     
     @action(detail=False, methods=['patch'])
@@ -117,7 +235,7 @@ class CartViewSet(viewsets.ViewSet):
         cart_item.quantity = quantity
         cart_item.save()
 
-        serializer = CartSerializer(cart)
+        serializer = CartSerializer(cart, context={'query_params': request.query_params})
         return Response(serializer.data)
 
     @action(detail=False, methods=['delete'])
@@ -132,31 +250,150 @@ class CartViewSet(viewsets.ViewSet):
             return Response({'error': "Item not found in cart"}, 
                             status=status.HTTP_404_NOT_FOUND)   
 
-        serializer = CartSerializer(cart)
+        serializer = CartSerializer(cart, context={'query_params': request.query_params})
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['post'])
+    @transaction.atomic
+    def batch(self, request):
+        """ Apply a list of add / set / remove operations and return one cart snapshot """
+        batch_serializer = CartBatchSerializer(data=request.data)
+        batch_serializer.is_valid(raise_exception=True)
+        operations = batch_serializer.validated_data['operations']
+
+        cart, created = Cart.objects.get_or_create(user=request.user)
+        existing = {item.product_id: item for item in cart.items.select_for_update()}
+        item_products = {item.id: item.product_id for item in existing.values()}
+
+        for operation in operations:
+            if 'product_id' not in operation:
+                if operation['item_id'] not in item_products:
+                    return Response({'error': "Item not found in cart"},
+                                    status=status.HTTP_404_NOT_FOUND)
+                operation['product_id'] = item_products[operation['item_id']]
+
+        # One query validates every product touched by the batch
+        product_ids = {operation['product_id'] for operation in operations}
+        products = Product.objects.filter(id__in=product_ids, is_active=True).in_bulk()
+
+        quantities = {product_id: item.quantity for product_id, item in existing.items()}
+        for operation in operations:
+            product_id = operation['product_id']
+            if operation['op'] != 'remove' and product_id not in products:
+                return Response({'error': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
+            if operation['op'] == 'add':
+                quantities[product_id] = quantities.get(product_id, 0) + operation['quantity']
+            elif operation['op'] == 'set':
+                quantities[product_id] = operation['quantity']
+            elif quantities.get(product_id, 0):
+                quantities[product_id] = 0
+            else:
+                return Response({'error': "Item not found in cart"},
+                                status=status.HTTP_404_NOT_FOUND)
+
+        for product_id in product_ids:
+            quantity = quantities.get(product_id, 0)
+            if quantity and quantity > products[product_id].stock:
+                product = products[product_id]
+                return Response({'error': f"Only {product.stock} items available for {product.name}"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        to_create, to_update, to_delete = [], [], []
+        for product_id in product_ids:
+            quantity = quantities.get(product_id, 0)
+            item = existing.get(product_id)
+            if item is None:
+                if quantity:
+                    to_create.append(CartItem(cart=cart, product_id=product_id, quantity=quantity))
+            elif not quantity:
+                to_delete.append(item.id)
+            elif item.quantity != quantity:
+                item.quantity = quantity
+                to_update.append(item)
+
+        if to_delete:
+            CartItem.objects.filter(id__in=to_delete).delete()
+        if to_create:
+            CartItem.objects.bulk_create(to_create)
+        if to_update:
+            CartItem.objects.bulk_update(to_update, ['quantity'])
+
+        serializer = CartSerializer(cart, context={'query_params': request.query_params})
         return Response(serializer.data)
 
     @action(detail=False, methods=['post'])
     def clear(self, request):
         cart = get_object_or_404(Cart, user=request.user)
         cart.items.all().delete()
-        serializer = CartSerializer(cart)
+        serializer = CartSerializer(cart, context={'query_params': request.query_params})
         return Response(serializer.data)
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication]
+    pagination_class = OrderCursorPagination
+    # A buyer's own orders must show up right after checkout
+    replica_actions = ('analytics',)
+
+    def wants_archive(self):
+        return self.action == 'list' and self.request.query_params.get('archived') in ('1', 'true')
+
+    def scoped(self, queryset):
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    def selected_fields(self):
+        """ The sparse fieldset (Backend.fieldsets) of a list or retrieve, if any """
+        if self.action not in ('list', 'retrieve'):
+            return None
+        return self.get_serializer().selected_fields
 
     def get_queryset(self):
-        if self.request.user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=self.request.user)
+        fields = self.selected_fields()
+        if self.wants_archive():
+            return self.scoped(ArchivedOrder.objects.for_list(fields))
+        queryset = self.scoped(Order.objects.all())
+        if self.action == 'list':
+            return queryset.for_list(fields)
+        return queryset.with_details(fields)
+
+    def get_serializer_class(self):
+        if self.wants_archive():
+            return ArchivedOrderListSerializer
+        if self.action == 'list':
+            return OrderListSerializer
+        return super().get_serializer_class()
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            # Archived orders keep their id, so old links keep working
+            order = generics.get_object_or_404(
+                self.scoped(ArchivedOrder.objects.with_details(self.selected_fields())), pk=kwargs['pk']
+            )
+            return Response(ArchivedOrderSerializer(order, context=self.get_serializer_context()).data)
     
+    @idempotent
     @transaction.atomic
     def create(self, request):
-        cart = get_object_or_404(Cart, user=request.user)
+        # The cart id signed into the token saves the cart lookup
+        cart_id = request_cart_id(request)
+        if cart_id is None:
+            cart_id = get_object_or_404(Cart, user=request.user).id
+
+        # One locked read of the cart lines and their products, in a stable
+        # order so concurrent checkouts sharing products cannot deadlock
+        items = list(
+            CartItem.objects.filter(cart_id=cart_id).select_related('product')
+            .select_for_update()
+            .order_by('product_id')
+        )
 
-        if not cart.items.exists():
+        if not items:
             return Response(
                 {'error': 'Cart is empty'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -166,15 +403,17 @@ class OrderViewSet(viewsets.ModelViewSet):
         shipping_serializer.is_valid(raise_exception=True)
 
         # stock validation
-        for item in cart.items.all():
+        for item in items:
             if item.quantity > item.product.stock:
                 return Response(
                     {"error": f"Insufficient stock for {item.product.name}"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-        subtotal = cart.total_price
-        tax = subtotal * 0.1
+        subtotal = CartItem.objects.filter(cart_id=cart_id).aggregate(
+            total=Sum(F('product__price') * F('quantity'))
+        )['total']
+        tax = (subtotal * TAX_RATE).quantize(Decimal('0.01'))
         total = subtotal + tax
 
         order = Order.objects.create(
@@ -188,16 +427,26 @@ class OrderViewSet(viewsets.ModelViewSet):
             payment_status='pending'
         )
 
-        for item in cart.items.all():
-            OrderItem.objects.create(
+        OrderItem.objects.bulk_create([
+            OrderItem(
                 order=order,
                 product=item.product,
                 quantity=item.quantity,
                 price=item.product.price
             )
+            for item in items
+        ])
 
-        cart.items.all().delete()
+        # Hold the stock until payment arrives or the reservation expires
+        try:
+            reserve_stock(order, [(item.product_id, item.quantity) for item in items])
+        except InsufficientStock as exc:
+            transaction.set_rollback(True)
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        CartItem.objects.filter(cart_id=cart_id).delete()
 
+        order = Order.objects.with_details().get(pk=order.pk)
         return Response(
             OrderSerializer(order).data,
             status=status.HTTP_201_CREATED
@@ -219,54 +468,78 @@ class OrderViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
     def analytics(self, request):
-        from django.db.models import Sum, Count
-        from datetime import datetime, timedelta
+        from django.db.models import Sum
+        from datetime import timedelta
+        from django.utils import timezone
         
         # Last 7 days analytics
-        week_ago = datetime.now() - timedelta(days=7)
-        
-        total_revenue = Order.objects.filter(
-            payment_status='completed'
-        ).aggregate(total=Sum('total_amount'))['total'] or 0
-        
-        total_orders = Order.objects.count()
-        pending_orders = Order.objects.filter(status='pending').count()
+        week_ago = timezone.localdate() - timedelta(days=7)
+
+        # Read from the daily rollups kept current by Backend.rollups
+        totals = DailySalesRollup.objects.aggregate(
+            revenue=Sum('revenue'),
+            orders=Sum('order_count'),
+            pending=Sum('pending_count')
+        )
         
-        daily_sales = Order.objects.filter(
-            created_at__gte=week_ago,
-            payment_status='completed'
-        ).extra(select={'date': 'DATE(created_at)'}).values('date').annotate(
-            revenue=Sum('total_amount'),
-            orders=Count('id')
-        ).order_by('date')
+        daily_sales = DailySalesRollup.objects.filter(
+            date__gte=week_ago,
+            paid_order_count__gt=0
+        ).values('date', 'revenue', orders=F('paid_order_count')).order_by('date')
         
         return Response({
-            "total_revenue": total_revenue,
-            "total_orders": total_orders,
-            "pending_orders": pending_orders,
+            "total_revenue": totals['revenue'] or 0,
+            "total_orders": totals['orders'] or 0,
+            "pending_orders": totals['pending'] or 0,
             "daily_sales": list(daily_sales)
         })
 
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        """ Admin endpoint streaming every order with its items as CSV or JSON lines """
+        # 'format' is taken by DRF's content negotiation
+        output = request.query_params.get('output', 'csv')
+        if output not in ('csv', 'jsonl'):
+            return Response({'error': "output must be csv or jsonl"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            since = request.query_params.get('since')
+            since = date.fromisoformat(since) if since else None
+        except ValueError:
+            return Response({'error': "since must be a YYYY-MM-DD date"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        content_type = 'text/csv' if output == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(
+            export_orders(output, since=since, status=request.query_params.get('status'),
+                          archived=request.query_params.get('archived') in ('1', 'true')),
+            content_type=f'{content_type}; charset=utf-8',
+        )
+        response['Content-Disposition'] = f'attachment; filename="orders.{output}"'
+        return response
+
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    @idempotent
     @transaction.atomic
     def confirm_payment(self, request, pk=None):
         order = get_object_or_404(
-            Order,
+            Order.objects.select_for_update(),
             id=pk,
             user=request.user,
             payment_status='pending'
         )
 
+        # the stock reserved at checkout becomes a sale
+        try:
+            commit_reservations(order)
+        except InsufficientStock as exc:
+            transaction.set_rollback(True)
+            return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
+
         # simulate payment success
         order.payment_status = 'completed'
         order.save()
 
-        # reduce stock AFTER payment
-        for item in order.items.all():
-            product = item.product
-            product.stock -= item.quantity
-            product.save()
-
         return Response({
             "message": "Payment successful",
             "order_id": order.id
@@ -1,9 +1,25 @@
 import React from 'react'
 
+// Let the browser pick the smallest WebP variant that fills the tile
+const variantSrcSet = (variants = {}) =>
+    Object.entries(variants).map(([width, url]) => `${url} ${width}w`).join(', ')
+
 const ProductCard = ({product, onAddToCart, onView}) => {
+    const srcSet = variantSrcSet(product.image_variants)
     return (
         <div className="bg-white rounded-lg shadow-md hover:shadow-xl transition p-6 flex flex-col">
-            <div className='text-6xl text-center mb-4'>{product.image}</div>
+            {srcSet ? (
+                <img
+                    src={product.image}
+                    srcSet={srcSet}
+                    sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw"
+                    alt={product.name}
+                    loading="lazy"
+                    className="w-full h-48 object-cover rounded mb-4"
+                />
+            ) : (
+                <div className='text-6xl text-center mb-4'>{product.image}</div>
+            )}
             <h3 className='text-lg font-bold mb-2'>{product.name}</h3>
             <p className="text-sm text-gray-600 mb-2">{product.category}</p>
             <p className="text-sm text-gray-500 mb-4 flex-grow">{product.description}</p>
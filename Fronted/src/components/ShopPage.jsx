@@ -4,6 +4,9 @@ import ProductCard from './ProductCard';
 import ProductDetail from './ProductDetail';
 import { productsAPI, categoriesAPI } from '../services/api';
 
+// What ProductCard and ProductDetail show; the API leaves the other fields out
+const PRODUCT_FIELDS = 'id,name,price,category,description,stock,image,image_variants';
+
 const ShopPage = ({ onAddToCart }) => {
     const [products, setProducts] = useState([]);
     const [categories, setCategories] = useState([]);
@@ -22,7 +25,7 @@ const ShopPage = ({ onAddToCart }) => {
         try {
             setLoading(true);
             const [productsData, categoriesData] = await Promise.all([
-                productsAPI.getAll(),
+                productsAPI.getAll({ fields: PRODUCT_FIELDS }),
                 categoriesAPI.getAllCategories(),
             ]);
 
@@ -45,7 +48,7 @@ const ShopPage = ({ onAddToCart }) => {
         const fetchFilteredProducts = async () => {
             try {
                 // Note: Not setting global loading here to prevent the whole UI from flickering
-                const params = {};
+                const params = { fields: PRODUCT_FIELDS };
                 if (search) params.search = search;
                 if (selectedCategory) params.category = selectedCategory.id; // Send ID to API
 
@@ -180,9 +180,19 @@ export const ordersAPI = {
         return response.data;
     },
 
-    // create new order
-    create: async (orderData) => {
-        const response = await api.post('/orders/', orderData);
+    // create new order; pass the same key when retrying so the order is placed once
+    create: async (orderData, idempotencyKey = crypto.randomUUID()) => {
+        const response = await api.post('/orders/', orderData, {
+            headers: {'Idempotency-Key': idempotencyKey},
+        });
+        return response.data;
+    },
+
+    // pay for an order; retries with the same key are answered without charging again
+    confirmPayment: async (id, idempotencyKey = crypto.randomUUID()) => {
+        const response = await api.post(`/orders/${id}/confirm_payment/`, {}, {
+            headers: {'Idempotency-Key': idempotencyKey},
+        });
         return response.data;
     },
 